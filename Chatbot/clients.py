@@ -0,0 +1,163 @@
+"""
+Process-wide registry of upstream API clients.
+
+Every Groq and Sarvam call goes through one pooled ``httpx.Client`` per
+upstream host, so TLS connections are kept alive and reused across requests
+instead of being re-established each time. httpx clients are thread safe;
+the registry only serialises their creation. Base URLs and pool limits come
+from settings (``GROQ_BASE_URL``, ``SARVAM_BASE_URL``, ``UPSTREAM_POOL_LIMITS``)
+so tests can point everything at a local stand-in server.
+
+The async views use ``httpx.AsyncClient`` pools instead. An async client is
+bound to the event loop it was created on, so there is one set per running
+loop; under an ASGI server that is one per worker process.
+"""
+import asyncio
+import os
+import threading
+import weakref
+
+import httpx
+from django.conf import settings
+
+DEFAULT_BASE_URLS = {
+    'groq': 'https://api.groq.com/openai/v1',
+    'sarvam': 'https://api.sarvam.ai',
+}
+
+DEFAULT_POOL_LIMITS = {
+    'max_connections': 20,
+    'max_keepalive_connections': 10,
+    'keepalive_expiry': 60,
+}
+
+# Generous read timeout: a full 1024-token completion can take a while
+DEFAULT_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+
+def base_url(upstream):
+    return getattr(settings, f'{upstream.upper()}_BASE_URL', DEFAULT_BASE_URLS[upstream])
+
+
+def pool_limits(upstream):
+    limits = {**DEFAULT_POOL_LIMITS, **getattr(settings, 'UPSTREAM_POOL_LIMITS', {}).get(upstream, {})}
+    return httpx.Limits(**limits)
+
+
+def sarvam_environment():
+    from sarvamai.environment import SarvamAIEnvironment
+    return SarvamAIEnvironment(
+        base=base_url('sarvam'),
+        production=base_url('sarvam').replace('http', 'ws', 1),
+    )
+
+
+class ClientRegistry:
+    def __init__(self):
+        self._lock = threading.RLock()  # SDK factories fetch their http pool under the lock
+        self._clients = {}
+        self._loop_clients = weakref.WeakKeyDictionary()  # event loop -> {name: client}
+
+    def _get(self, name, factory, clients=None):
+        clients = self._clients if clients is None else clients
+        client = clients.get(name)
+        if client is None:
+            with self._lock:
+                client = clients.get(name)
+                if client is None:
+                    client = clients[name] = factory()
+        return client
+
+    def _get_async(self, name, factory):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._loop_clients.setdefault(loop, {})
+        return self._get(name, factory, clients)
+
+    def http(self, upstream):
+        """Pooled keep-alive client for ``upstream`` ('groq' or 'sarvam')."""
+        def factory():
+            return httpx.Client(
+                base_url=base_url(upstream),
+                limits=pool_limits(upstream),
+                timeout=DEFAULT_TIMEOUT,
+            )
+        return self._get(f'http:{upstream}', factory)
+
+    def async_http(self, upstream):
+        """Pooled keep-alive async client for ``upstream`` on the running event loop."""
+        def factory():
+            return httpx.AsyncClient(
+                base_url=base_url(upstream),
+                limits=pool_limits(upstream),
+                timeout=DEFAULT_TIMEOUT,
+            )
+        return self._get_async(f'http:{upstream}', factory)
+
+    def groq(self):
+        """Groq SDK client (used for the vision models) sharing the groq pool."""
+        def factory():
+            import groq
+            return groq.Groq(
+                api_key=os.getenv('GROQ_API_KEY'),
+                base_url=base_url('groq'),
+                http_client=self.http('groq'),
+            )
+        return self._get('sdk:groq', factory)
+
+    def async_groq(self):
+        """AsyncGroq SDK client sharing the async groq pool."""
+        def factory():
+            import groq
+            return groq.AsyncGroq(
+                api_key=os.getenv('GROQ_API_KEY'),
+                base_url=base_url('groq'),
+                http_client=self.async_http('groq'),
+            )
+        return self._get_async('sdk:groq', factory)
+
+    def sarvam(self):
+        """SarvamAI SDK client sharing the sarvam pool."""
+        def factory():
+            from sarvamai import SarvamAI
+            return SarvamAI(
+                api_subscription_key=os.getenv('SARVAM_API_KEY'),
+                environment=sarvam_environment(),
+                httpx_client=self.http('sarvam'),
+            )
+        return self._get('sdk:sarvam', factory)
+
+    def async_sarvam(self):
+        """AsyncSarvamAI SDK client sharing the async sarvam pool."""
+        def factory():
+            from sarvamai import AsyncSarvamAI
+            return AsyncSarvamAI(
+                api_subscription_key=os.getenv('SARVAM_API_KEY'),
+                environment=sarvam_environment(),
+                httpx_client=self.async_http('sarvam'),
+            )
+        return self._get_async('sdk:sarvam', factory)
+
+    def close(self):
+        """
+        Close every pooled connection; clients are recreated on next use.
+        Async pools can only be closed from their own loop (see ``aclose``),
+        so here they are just dropped.
+        """
+        with self._lock:
+            clients, self._clients = self._clients, {}
+            self._loop_clients = weakref.WeakKeyDictionary()
+        for name, client in clients.items():
+            if name.startswith('http:'):
+                client.close()
+
+    async def aclose(self):
+        """Close the async pools of the running event loop."""
+        with self._lock:
+            clients = self._loop_clients.pop(asyncio.get_running_loop(), {})
+        for name, client in clients.items():
+            if name.startswith('http:'):
+                await client.aclose()
+
+
+registry = ClientRegistry()
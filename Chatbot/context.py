@@ -0,0 +1,142 @@
+"""
+Per-user (or per-session) chat context snapshot.
+
+Building the prompt context used to cost several queries per message (cart,
+cart lines, total, recent orders, last messages). The snapshot keeps each
+part as its own entry in the shared cache:
+
+* ``cart``   - cart lines and total (keyed by cart id), tagged with the
+               catalog version so a product rename or price change rebuilds it
+* ``orders`` - the three most recent orders
+* ``turns``  - ring buffer of the last ``MAX_TURNS`` chat messages
+* ``summary`` - the stored rolling summary of older turns (Chatbot.history)
+
+Chatbot.signals deletes an entry when its rows change (for carts, on
+cart.signals.cart_changed; for turns, on every saved chat message), so a warm
+read gets everything with one ``get_many`` and whatever is missing is rebuilt
+from the database with one query per part. The entries only stay consistent
+across workers if ``default`` is a shared cache (see CACHES in settings).
+"""
+from decimal import Decimal
+
+from django.core.cache import cache
+
+from products import cache as catalog_cache
+
+MAX_TURNS = 10
+TIMEOUT = 60 * 60 * 24
+
+
+def owner_key(user_id=None, session_id=None):
+    return f'user:{user_id}' if user_id else f'session:{session_id}'
+
+
+def _key(part, owner):
+    return f'chatbot:context:{part}:{owner}'
+
+
+def _load_cart(cart_id):
+    from cart.models import CartItem, line_subtotal
+
+    items = (
+        CartItem.objects.filter(cart_id=cart_id)
+        .select_related('product')
+        .annotate(subtotal=line_subtotal())
+        .order_by('id')
+    )
+    lines = [(item.quantity, item.product.name, f'{item.subtotal:.2f}') for item in items]
+    total = sum((Decimal(subtotal) for _qty, _name, subtotal in lines), Decimal('0.00'))
+    return {'lines': lines, 'total': f'{total:.2f}'}
+
+
+def _load_orders(user_id):
+    from products.models import Order
+
+    orders = Order.objects.filter(user_id=user_id).order_by('-created_at')[:3]
+    return [
+        (order.id, order.status, str(order.total_price), order.created_at.strftime('%Y-%m-%d'))
+        for order in orders
+    ]
+
+
+def _load_turns(user_id=None, session_id=None):
+    from .models import ChatMessage
+
+    messages = ChatMessage.objects.filter(**({'user_id': user_id} if user_id else {'session_id': session_id}))
+    latest = messages.order_by('-created_at', '-id').values_list('id', 'role', 'message')[:MAX_TURNS]
+    return [{'id': pk, 'role': role, 'content': content} for pk, role, content in reversed(latest)]
+
+
+def _load_summary(owner):
+    from .models import ConversationSummary
+
+    summary = ConversationSummary.objects.filter(owner=owner).values_list('summary', 'through').first()
+    text, through = summary or ('', 0)
+    return {'text': text, 'through': through}
+
+
+def get_snapshot(user_id=None, session_id=None, cart_id=None):
+    """
+    Returns {'cart', 'orders', 'turns', 'summary'} for a user and their cart
+    (or just 'turns' and 'summary' for an anonymous session), loading only
+    the parts missing from the cache.
+    """
+    owner = owner_key(user_id, session_id)
+    keys = {'turns': _key('turns', owner), 'summary': _key('summary', owner)}
+    if user_id:
+        keys.update(cart=_key('cart', f'cart:{cart_id}'), orders=_key('orders', owner))
+    cached = cache.get_many(keys.values())
+
+    snapshot = {part: cached.get(key) for part, key in keys.items()}
+    stale = {}
+
+    if user_id:
+        version = catalog_cache.get_version(catalog_cache.PRODUCTS)
+        cart = snapshot['cart']
+        if cart is None or cart.get('version') != version:
+            snapshot['cart'] = stale[keys['cart']] = {**_load_cart(cart_id), 'version': version}
+        if snapshot['orders'] is None:
+            snapshot['orders'] = stale[keys['orders']] = _load_orders(user_id)
+    if snapshot['turns'] is None:
+        snapshot['turns'] = stale[keys['turns']] = _load_turns(user_id, session_id)
+    if snapshot['summary'] is None:
+        snapshot['summary'] = stale[keys['summary']] = _load_summary(owner)
+
+    if stale:
+        cache.set_many(stale, TIMEOUT)
+    return snapshot
+
+
+def render_context(name, snapshot):
+    """Formats a logged-in user's snapshot as the prompt's user-info block."""
+    context = f"User: {name}\n"
+
+    cart = snapshot['cart']
+    if cart['lines']:
+        context += "Current Cart:\n"
+        for quantity, product_name, subtotal in cart['lines']:
+            context += f"- {quantity}x {product_name} (${subtotal})\n"
+        context += f"Cart Total: ${cart['total']}\n"
+    else:
+        context += "Current Cart: Empty\n"
+
+    if snapshot['orders']:
+        context += "Recent Orders:\n"
+        for order_id, status, total_price, created in snapshot['orders']:
+            context += f"- Order #{order_id}: {status} (${total_price}) - {created}\n"
+    else:
+        context += "Recent Orders: None\n"
+    return context
+
+
+def invalidate(part, user_id=None, session_id=None):
+    cache.delete(_key(part, owner_key(user_id, session_id)))
+
+
+def invalidate_summary(owner):
+    cache.delete(_key('summary', owner))
+
+
+def invalidate_cart(cart_id):
+    cache.delete(_key('cart', f'cart:{cart_id}'))
+
@@ -0,0 +1,166 @@
+"""
+Document ingestion for chatbot uploads.
+
+PDFs are parsed page by page in a process pool (PyPDF2 is pure Python and
+would otherwise hold the GIL in the request thread), stopping at
+``DOCUMENT_MAX_PAGES`` pages or ``DOCUMENT_MAX_CHARS`` characters. The
+resulting chunks are cached by the file's SHA-256, so uploading the same
+report again skips extraction entirely. Only the chunks most relevant to the
+user's question, up to ``DOCUMENT_CONTEXT_CHARS``, go into the prompt.
+"""
+import hashlib
+import math
+import multiprocessing
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+
+CHUNK_CHARS = 1200
+CACHE_TIMEOUT = 60 * 60 * 24
+WORD_RE = re.compile(r'\w+')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def extract_pdf_pages(source, max_pages, max_chars):
+    """
+    Returns the text of the first pages of a PDF (a path or bytes), stopping
+    at ``max_pages`` pages or ``max_chars`` characters. Runs in the pool.
+    """
+    import io
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(source if isinstance(source, str) else io.BytesIO(source))
+    pages, total = [], 0
+    for page in reader.pages[:max_pages]:
+        text = (page.extract_text() or '')[:max_chars - total]
+        pages.append(text)
+        total += len(text)
+        if total >= max_chars:
+            break
+    return pages
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the web process has threads of its own
+            _pool = ProcessPoolExecutor(
+                max_workers=_setting('DOCUMENT_WORKERS', 2),
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+
+def chunk_pages(pages):
+    """Splits page texts into (page number, text) chunks of about CHUNK_CHARS."""
+    chunks = []
+    for number, text in enumerate(pages, start=1):
+        current = []
+        size = 0
+        for paragraph in re.split(r'\n\s*\n', text):
+            paragraph = ' '.join(paragraph.split())
+            if not paragraph:
+                continue
+            if current and size + len(paragraph) > CHUNK_CHARS:
+                chunks.append((number, ' '.join(current)))
+                current, size = [], 0
+            # Paragraphs longer than a chunk are cut into chunk-sized pieces
+            while len(paragraph) > CHUNK_CHARS:
+                chunks.append((number, paragraph[:CHUNK_CHARS]))
+                paragraph = paragraph[CHUNK_CHARS:]
+            current.append(paragraph)
+            size += len(paragraph)
+        if current:
+            chunks.append((number, ' '.join(current)))
+    return chunks
+
+
+def select_chunks(chunks, question, max_chars):
+    """
+    Picks the chunks that best match ``question`` (TF-IDF over the document's
+    own chunks) until ``max_chars`` is used, returned in document order. With
+    no usable question terms the document is taken from the start.
+    """
+    chunk_terms = [Counter(WORD_RE.findall(text.lower())) for _page, text in chunks]
+    terms = set(WORD_RE.findall((question or '').lower()))
+    document_frequency = Counter(term for counts in chunk_terms for term in counts.keys() & terms)
+
+    def score(index):
+        counts = chunk_terms[index]
+        return sum(
+            (1 + math.log(counts[term])) * math.log(1 + len(chunks) / document_frequency[term])
+            for term in terms if counts[term]
+        )
+
+    in_order = not document_frequency
+    ranked = range(len(chunks)) if in_order else sorted(range(len(chunks)), key=lambda index: (-score(index), index))
+
+    picked, used = [], 0
+    for index in ranked:
+        size = len(chunks[index][1])
+        if used + size > max_chars:
+            if in_order:
+                break  # keep a plain prefix readable
+            continue
+        picked.append(index)
+        used += size
+    return [chunks[index] for index in sorted(picked)]
+
+
+def _file_digest(uploaded_file):
+    digest = hashlib.sha256()
+    for block in uploaded_file.chunks():
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def document_chunks(uploaded_file, file_ext):
+    """Extracted chunks for a .pdf or .txt upload, from the cache when possible."""
+    key = f'chatbot:document:{_file_digest(uploaded_file)}'
+    chunks = cache.get(key)
+    if chunks is not None:
+        return chunks
+
+    max_pages = _setting('DOCUMENT_MAX_PAGES', 50)
+    max_chars = _setting('DOCUMENT_MAX_CHARS', 200_000)
+    if file_ext == 'pdf':
+        # Large uploads are already on disk; hand the worker the path, not the bytes
+        if hasattr(uploaded_file, 'temporary_file_path'):
+            source = uploaded_file.temporary_file_path()
+        else:
+            uploaded_file.seek(0)
+            source = uploaded_file.read()
+        future = _get_pool().submit(extract_pdf_pages, source, max_pages, max_chars)
+        pages = future.result(timeout=_setting('DOCUMENT_TIMEOUT', 30))
+    else:
+        uploaded_file.seek(0)
+        pages = [uploaded_file.read(max_chars).decode('utf-8', errors='replace')]
+
+    chunks = chunk_pages(pages)
+    cache.set(key, chunks, CACHE_TIMEOUT)
+    return chunks
+
+
+def document_context(uploaded_file, file_ext, question):
+    """
+    The parts of an uploaded document worth putting in the prompt, marked
+    with their page numbers, or '' if no text could be extracted.
+    """
+    chunks = document_chunks(uploaded_file, file_ext)
+    selected = select_chunks(chunks, question, _setting('DOCUMENT_CONTEXT_CHARS', 6000))
+    if not selected:
+        return ''
+    if file_ext != 'pdf':
+        return '\n\n'.join(text for _page, text in selected)
+    return '\n\n'.join(f"[Page {page}] {text}" for page, text in selected)
@@ -0,0 +1,191 @@
+"""
+Circuit breakers and rate limits shared by every worker process.
+
+Each upstream model or endpoint ("groq:chat:<model>", "groq:vision:<model>",
+"sarvam:tts", "sarvam:stt") has a guard with two parts:
+
+* a token bucket (``rate`` requests per second, up to ``burst`` at once) that
+  keeps the combined outbound rate of all workers under our quota, and
+* a circuit breaker that opens after ``failure_threshold`` consecutive
+  upstream failures (429, 5xx, timeouts, connection errors). While open,
+  calls fail fast with ``UpstreamUnavailable`` so callers can use their
+  fallback. After ``reset_after`` seconds one probe call is let through; its
+  result closes the breaker again or re-opens it.
+
+State lives in a small SQLite file (``UPSTREAM_GUARD_PATH``, by default in
+the temp dir) rather than the app database: gunicorn workers on a host share
+it, a check is a sub-millisecond local transaction, and it works from the
+background thread pools. Limits come from ``UPSTREAM_GUARDS``, keyed by guard
+name or by upstream ('groq', 'sarvam').
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import httpx
+from django.conf import settings
+
+DEFAULT_LIMITS = {
+    # Groq's per-model quota is 30 requests a minute
+    'groq': {'rate': 0.5, 'burst': 10, 'failure_threshold': 5, 'reset_after': 30},
+    'sarvam': {'rate': 1, 'burst': 5, 'failure_threshold': 5, 'reset_after': 30},
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS guards (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    refilled_at REAL NOT NULL,
+    failures INTEGER NOT NULL DEFAULT 0,
+    open_until REAL NOT NULL DEFAULT 0
+)
+"""
+
+
+class UpstreamUnavailable(Exception):
+    """The guard refused the call: breaker open or no tokens left."""
+
+    def __init__(self, name, reason, retry_after):
+        super().__init__(f"{name} unavailable ({reason}), retry in {retry_after:.1f}s")
+        self.name = name
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def limits(name):
+    configured = getattr(settings, 'UPSTREAM_GUARDS', {})
+    upstream = name.split(':', 1)[0]
+    return {**DEFAULT_LIMITS[upstream], **configured.get(upstream, {}), **configured.get(name, {})}
+
+
+def is_upstream_failure(exc):
+    """Whether ``exc`` says the upstream is unhealthy (rather than our request being bad)."""
+    if isinstance(exc, httpx.TransportError):
+        return True
+    response = getattr(exc, 'response', None)
+    status = getattr(exc, 'status_code', None) or getattr(response, 'status_code', None)
+    if status is not None:
+        return status == 429 or status >= 500
+    # SDK connection / timeout errors carry no status
+    return type(exc).__name__ in ('APIConnectionError', 'APITimeoutError')
+
+
+class GuardStore:
+    def __init__(self):
+        self._local = threading.local()
+
+    def path(self):
+        return getattr(settings, 'UPSTREAM_GUARD_PATH',
+                       os.path.join(tempfile.gettempdir(), 'pharmacare-upstream-guards.sqlite3'))
+
+    def _connection(self):
+        path = self.path()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.path != path:
+            conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+            conn.execute(SCHEMA)
+            self._local.conn, self._local.path = conn, path
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')  # serialises all workers on the file
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def acquire(self, name):
+        """Takes one token for ``name`` or raises UpstreamUnavailable."""
+        config = limits(name)
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                'SELECT tokens, refilled_at, failures, open_until FROM guards WHERE name = ?', (name,)
+            ).fetchone()
+            tokens, refilled_at, failures, open_until = row or (config['burst'], now, 0, 0)
+
+            if now < open_until:
+                raise UpstreamUnavailable(name, 'circuit open', open_until - now)
+            if failures >= config['failure_threshold']:
+                # Half-open: this call is the probe, everyone else keeps failing fast
+                open_until = now + config['reset_after']
+
+            tokens = min(config['burst'], tokens + (now - refilled_at) * config['rate'])
+            if tokens < 1:
+                raise UpstreamUnavailable(name, 'rate limited', (1 - tokens) / config['rate'])
+
+            conn.execute(
+                'INSERT OR REPLACE INTO guards (name, tokens, refilled_at, failures, open_until) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (name, tokens - 1, now, failures, open_until),
+            )
+
+    def record_success(self, name):
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE guards SET failures = 0, open_until = 0 WHERE name = ? AND failures > 0', (name,)
+            )
+
+    def record_failure(self, name):
+        config = limits(name)
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE guards SET failures = failures + 1, '
+                'open_until = CASE WHEN failures + 1 >= ? THEN ? ELSE open_until END WHERE name = ?',
+                (config['failure_threshold'], now + config['reset_after'], name),
+            )
+
+    def state(self, name):
+        """'closed', 'open' or 'half-open', for monitoring and tests."""
+        row = self._connection().execute(
+            'SELECT failures, open_until FROM guards WHERE name = ?', (name,)
+        ).fetchone()
+        if row is None or row[0] < limits(name)['failure_threshold']:
+            return 'closed'
+        return 'open' if time.time() < row[1] else 'half-open'
+
+    def reset(self):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM guards')
+
+
+store = GuardStore()
+
+
+@contextmanager
+def guarded(name):
+    """
+    Runs the body as one call to upstream ``name``: raises
+    UpstreamUnavailable up front if the guard refuses it, and feeds the
+    outcome back into the breaker.
+    """
+    store.acquire(name)
+    try:
+        yield
+    except Exception as e:
+        if is_upstream_failure(e):
+            store.record_failure(name)
+        raise
+    store.record_success(name)
+
+
+@asynccontextmanager
+async def aguarded(name):
+    """``guarded`` for coroutines; the guard file is only touched off the event loop."""
+    await asyncio.to_thread(store.acquire, name)
+    try:
+        yield
+    except Exception as e:
+        if is_upstream_failure(e):
+            await asyncio.to_thread(store.record_failure, name)
+        raise
+    await asyncio.to_thread(store.record_success, name)
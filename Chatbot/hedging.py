@@ -0,0 +1,114 @@
+"""
+Hedged requests over a chain of fallback models.
+
+The first model in the chain is asked straight away. If it has not answered
+once its usual latency has passed (the ``GROQ_HEDGE_PERCENTILE`` of its recent
+successful calls, or ``hedge_after`` seconds until enough samples exist), the
+next model is asked too, and whichever answers first wins; the others are
+told to stop. A model that fails (429, 5xx, its own ``timeout``) hands over to
+the next one immediately, without sleeping. Chat latency is thus capped at
+roughly the hedge delay plus the fallback's latency, instead of following the
+primary's tail. ``arace`` runs the attempts as asyncio tasks.
+
+Streamed replies are raced on their first token instead, with delays taken
+from ``first_token_latencies``; once one model has started talking the rest
+are dropped.
+"""
+import asyncio
+import threading
+from collections import defaultdict, deque
+
+from django.conf import settings
+
+DEFAULT_PERCENTILE = 0.95
+MIN_SAMPLES = 20
+
+
+class AttemptTimeout(Exception):
+    def __init__(self, model, timeout):
+        super().__init__(f"{model} did not answer within {timeout}s")
+        self.model = model
+
+
+class LatencyTracker:
+    """Recent successful-call latencies per model, for percentile lookups."""
+
+    def __init__(self, size=200):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=size))
+
+    def record(self, model, seconds):
+        with self._lock:
+            self._samples[model].append(seconds)
+
+    def percentile(self, model, q):
+        with self._lock:
+            samples = sorted(self._samples[model])
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+latencies = LatencyTracker()
+first_token_latencies = LatencyTracker()
+
+
+def hedge_delay(spec, tracker=None):
+    """Seconds to give a model before asking the next one as well."""
+    q = getattr(settings, 'GROQ_HEDGE_PERCENTILE', DEFAULT_PERCENTILE)
+    observed = (tracker or latencies).percentile(spec['model'], q)
+    delay = observed if observed is not None else spec['hedge_after']
+    return min(delay, spec['timeout'])
+
+
+async def arace(chain, attempt, tracker=None):
+    """
+    Awaits ``attempt(spec)`` down ``chain`` with hedging, one task per model,
+    and returns the first successful result; attempts that lost or ran out
+    of time are cancelled outright. If every model fails, raises the first
+    model's error (the most informative one, e.g. its 429). Hedge delays come
+    from ``tracker``, ``latencies`` unless given.
+    """
+    loop = asyncio.get_running_loop()
+    in_flight = {}  # task -> (spec, deadline)
+    errors = []
+    remaining = list(chain)
+    hedge_at = None
+
+    def launch():
+        nonlocal hedge_at
+        spec = remaining.pop(0)
+        started = loop.time()
+        in_flight[asyncio.ensure_future(attempt(spec))] = (spec, started + spec['timeout'])
+        hedge_at = started + hedge_delay(spec, tracker)
+
+    launch()
+    try:
+        while in_flight:
+            wake_at = min(deadline for _spec, deadline in in_flight.values())
+            if remaining:
+                wake_at = min(wake_at, hedge_at)
+            done, _ = await asyncio.wait(in_flight, timeout=max(0, wake_at - loop.time()),
+                                         return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                del in_flight[task]
+                if task.exception() is None:
+                    return task.result()
+                errors.append(task.exception())
+
+            now = loop.time()
+            for task, (spec, deadline) in list(in_flight.items()):
+                if now >= deadline:
+                    task.cancel()
+                    del in_flight[task]
+                    errors.append(AttemptTimeout(spec['model'], spec['timeout']))
+
+            if remaining and (not in_flight or now >= hedge_at):
+                launch()
+
+        raise errors[0]
+    finally:
+        # The losers, or everything if the request itself was cancelled
+        for task in in_flight:
+            task.cancel()
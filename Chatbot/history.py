@@ -0,0 +1,136 @@
+"""
+Token-budgeted conversation history.
+
+Only the newest turns that fit ``CHAT_HISTORY_TOKEN_BUDGET`` are sent with a
+message; everything older is folded into a rolling summary per conversation
+(``ConversationSummary``), which goes out as one short system message. Prompt
+size therefore stays bounded however long a user chats or however much they
+paste.
+
+Folding calls the small Groq model, so it is batched: turns that no longer
+fit keep going out in full until ``FOLD_BATCH_TURNS`` of them, or
+``CHAT_HISTORY_FOLD_TOKENS`` worth, have piled up, and only then are they
+folded together. The fold runs on a background thread; the current message
+goes out with the previous summary and catches up on the next one. Turns are folded before they fall out of the context snapshot's
+ring buffer, so nothing is dropped without being summarized. If a fold fails
+(Groq down or rate limited), the turns it should have covered keep going out
+in full, over budget, until a later fold succeeds.
+"""
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from . import context
+from .models import ConversationSummary
+from .utils import summarize_conversation
+
+DEFAULT_BUDGET = 1500
+MESSAGE_OVERHEAD = 4  # role and separator tokens per message
+DEFAULT_FOLD_TOKENS = 500
+MAX_KEPT_TURNS = 4
+# Kept turns plus a full batch still leave room in the ring buffer for the
+# exchange that arrives while the fold runs, so nothing drops out unsummarized
+FOLD_BATCH_TURNS = context.MAX_TURNS - MAX_KEPT_TURNS - 2
+
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='chat-summary')
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+def count_tokens(text):
+    """
+    Estimates a message's prompt tokens without a tokenizer: about four UTF-8
+    bytes per token, which also holds up for Devanagari.
+    """
+    return MESSAGE_OVERHEAD + math.ceil(len((text or '').encode('utf-8')) / 4)
+
+
+def select_history(turns, summary, budget):
+    """
+    Splits the turns not yet summarized into (kept, to_fold): the newest ones
+    that fit ``budget`` alongside the summary, and the older rest.
+    """
+    pending = [turn for turn in turns if turn['id'] > summary['through']]
+    used = count_tokens(summary['text']) if summary['text'] else 0
+
+    kept = []
+    for turn in reversed(pending):
+        cost = count_tokens(turn['content'])
+        if len(kept) >= MAX_KEPT_TURNS or used + cost > budget:
+            break
+        kept.append(turn)
+        used += cost
+    kept.reverse()
+    return kept, pending[:len(pending) - len(kept)]
+
+
+def fold_is_due(to_fold):
+    """True once the overflow is worth a summarize call."""
+    limit = getattr(settings, 'CHAT_HISTORY_FOLD_TOKENS', DEFAULT_FOLD_TOKENS)
+    return len(to_fold) >= FOLD_BATCH_TURNS or sum(count_tokens(turn['content']) for turn in to_fold) >= limit
+
+
+def _fold_failed_key(owner):
+    return f'chatbot:history:fold-failed:{owner}'
+
+
+def fold_turns(owner, summary, turns):
+    """Summarizes ``turns`` into the stored summary for ``owner``."""
+    text = summarize_conversation(summary['text'], turns)
+    if not text:
+        return None
+    through = turns[-1]['id']
+    # Never move the summary backwards if another worker got further
+    updated = ConversationSummary.objects.filter(owner=owner, through__lt=through).update(summary=text, through=through)
+    if not updated:
+        ConversationSummary.objects.get_or_create(owner=owner, defaults={'summary': text, 'through': through})
+    context.invalidate_summary(owner)
+    cache.delete(_fold_failed_key(owner))
+    return text
+
+
+def _fold_in_worker(owner, summary, turns):
+    folded = None
+    try:
+        folded = fold_turns(owner, summary, turns)
+    finally:
+        if folded is None:
+            cache.set(_fold_failed_key(owner), True, context.TIMEOUT)
+        with _in_flight_lock:
+            _in_flight.discard(owner)
+        connections.close_all()
+
+
+def build_history(snapshot, user_id=None, session_id=None):
+    """
+    Returns the Groq-format history for a chat turn: the rolling summary (if
+    any) followed by the newest turns that fit the token budget. Turns that
+    no longer fit ride along until there are enough of them to fold into the
+    summary in one go.
+    """
+    budget = getattr(settings, 'CHAT_HISTORY_TOKEN_BUDGET', DEFAULT_BUDGET)
+    summary = snapshot['summary']
+    kept, to_fold = select_history(snapshot['turns'], summary, budget)
+
+    if to_fold and not fold_is_due(to_fold):
+        kept = to_fold + kept
+    elif to_fold:
+        owner = context.owner_key(user_id, session_id)
+        with _in_flight_lock:
+            queued = owner in _in_flight
+            _in_flight.add(owner)
+        if not queued:
+            executor.submit(_fold_in_worker, owner, summary, to_fold)
+        if cache.get(_fold_failed_key(owner)):
+            # Nothing summarizes these yet; dropping them would lose them
+            kept = to_fold + kept
+
+    history = []
+    if summary['text']:
+        history.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary['text']}"})
+    history.extend({"role": turn['role'], "content": turn['content']} for turn in kept)
+    return history
@@ -0,0 +1,65 @@
+"""
+Image preparation for the vision models.
+
+Phone photos of prescriptions and reports are often 5-12 MB. Before an image
+is sent upstream it is turned upright (EXIF orientation), shrunk so its
+longer side is at most ``VISION_MAX_SIDE`` pixels, converted to grayscale
+for documents and re-encoded as JPEG (or WebP). Vision results are cached by
+the SHA-256 of the original upload, so the same photo is never analyzed
+twice.
+"""
+import base64
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.cache import cache
+from PIL import Image, ImageOps
+
+CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def prepare_image(image_bytes, grayscale=True):
+    """Returns (bytes, mime type) of the image re-encoded for a vision model."""
+    max_side = getattr(settings, 'VISION_MAX_SIDE', 1600)
+    image_format = getattr(settings, 'VISION_IMAGE_FORMAT', 'JPEG').upper()
+    quality = getattr(settings, 'VISION_IMAGE_QUALITY', 80)
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)  # never upscales
+        image = image.convert('L' if grayscale else 'RGB')
+        output = io.BytesIO()
+        image.save(output, format=image_format, quality=quality, optimize=True)
+    return output.getvalue(), Image.MIME[image_format]
+
+
+def image_data_url(image_bytes, grayscale=True):
+    """The prepared image as a data: URL for an ``image_url`` message part."""
+    data, mime_type = prepare_image(image_bytes, grayscale)
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
+def image_digest(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def _key(kind, digest):
+    return f'chatbot:vision:{kind}:{digest}'
+
+
+def get_vision_result(kind, digest):
+    """A cached result of analysis ``kind`` for the image with ``digest``, or None."""
+    return cache.get(_key(kind, digest))
+
+
+def set_vision_result(kind, digest, result):
+    cache.set(_key(kind, digest), result, CACHE_TIMEOUT)
+
+
+async def aget_vision_result(kind, digest):
+    return await cache.aget(_key(kind, digest))
+
+
+async def aset_vision_result(kind, digest, result):
+    await cache.aset(_key(kind, digest), result, CACHE_TIMEOUT)
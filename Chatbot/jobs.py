@@ -0,0 +1,92 @@
+"""
+Background transcription of voice notes.
+
+Sarvam's speech-to-text is a batch API: create a job, upload, then wait for
+it to finish, which can take tens of seconds. ``transcribe_api`` only saves
+the upload and records a ``TranscriptionJob``; the Sarvam lifecycle runs on a
+small thread pool in the same process, and the browser polls
+``transcription_status`` until the job is done or failed.
+
+The pool lives and dies with the web worker, so a restart or crash drops the
+jobs it held. A job still pending or running after
+``TRANSCRIPTION_STALE_AFTER`` seconds is taken to be one of those and is
+marked failed when next polled (or by ``fail_stale_jobs``), so the browser
+stops waiting and asks the user to record again.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import TranscriptionJob
+from .utils import transcribe_audio
+
+executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'TRANSCRIPTION_WORKERS', 4),
+    thread_name_prefix='transcription',
+)
+
+UNFINISHED = ('pending', 'running')
+INTERRUPTED = 'Transcription was interrupted, please try again'
+
+
+def run_transcription(job_id):
+    """Runs one job to completion, recording the transcript or the failure."""
+    job = TranscriptionJob.objects.get(pk=job_id)
+    TranscriptionJob.objects.filter(pk=job.pk).update(status='running', updated_at=timezone.now())
+    try:
+        text = transcribe_audio(job.audio_path, language_code=job.language_code)
+        if text:
+            job.status, job.text = 'done', text
+        else:
+            job.status, job.error = 'failed', 'Transcription failed'
+    except Exception as e:
+        job.status, job.error = 'failed', str(e)
+    finally:
+        try:
+            os.remove(job.audio_path)
+        except OSError:
+            pass
+    job.save(update_fields=['status', 'text', 'error', 'updated_at'])
+    return job
+
+
+def stale_cutoff():
+    return timezone.now() - timedelta(seconds=getattr(settings, 'TRANSCRIPTION_STALE_AFTER', 600))
+
+
+def fail_stale_jobs(jobs=None):
+    """
+    Marks jobs that have been pending or running for too long as failed and
+    deletes their uploads. Returns how many were reclaimed.
+    """
+    jobs = TranscriptionJob.objects.all() if jobs is None else jobs
+    stale = list(jobs.filter(status__in=UNFINISHED, updated_at__lt=stale_cutoff()))
+    if not stale:
+        return 0
+    # Conditional, so a worker finishing one of these at the same moment wins
+    reclaimed = TranscriptionJob.objects.filter(
+        pk__in=[job.pk for job in stale], status__in=UNFINISHED, updated_at__lt=stale_cutoff(),
+    ).update(status='failed', error=INTERRUPTED, updated_at=timezone.now())
+    for job in stale:
+        try:
+            os.remove(job.audio_path)
+        except OSError:
+            pass
+    return reclaimed
+
+
+def _run_in_worker(job_id):
+    try:
+        run_transcription(job_id)
+    finally:
+        # Worker threads get their own DB connections; don't leak them
+        connections.close_all()
+
+
+def submit_transcription(job):
+    """Queues ``job`` on the pool once the transaction that created it commits."""
+    transaction.on_commit(lambda: executor.submit(_run_in_worker, job.pk))
@@ -1,3 +1,4 @@
+import uuid
 from django.db import models
 from django.conf import settings
 
@@ -18,3 +19,40 @@ class ChatMessage(models.Model):
 
     class Meta:
         ordering = ['created_at']
+
+class TranscriptionJob(models.Model):
+    """A voice note being transcribed in the background (see Chatbot.jobs)."""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    session_id = models.CharField(max_length=100, null=True, blank=True)
+    audio_path = models.CharField(max_length=500)
+    language_code = models.CharField(max_length=10, default='unknown')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    text = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Transcription {self.id} ({self.status})"
+
+class ConversationSummary(models.Model):
+    """
+    Rolling summary of a conversation's older messages (see Chatbot.history).
+    ``owner`` is 'user:<id>' or 'session:<key>'; ``through`` is the id of the
+    newest ChatMessage folded into the summary.
+    """
+    owner = models.CharField(max_length=120, unique=True)
+    summary = models.TextField(blank=True)
+    through = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary for {self.owner}"
@@ -0,0 +1,48 @@
+"""
+Stages of a chat request.
+
+Reading an attachment (vision OCR or PDF extraction) and assembling the
+user's context and history don't depend on each other, so ``chat_api`` runs
+them concurrently and an attachment turn costs about max(OCR, DB) instead of
+the sum. Blocking extraction work runs on a small bounded pool
+(``CHAT_PIPELINE_WORKERS``) so a burst of uploads can't take every thread.
+Each stage's duration is logged and returned in a ``Server-Timing`` header.
+"""
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'CHAT_PIPELINE_WORKERS', 4),
+    thread_name_prefix='chat-pipeline',
+)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs a blocking, non-ORM ``func`` on the pipeline pool."""
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+class StageTimings:
+    def __init__(self):
+        self.durations = {}  # stage name -> seconds
+
+    async def run(self, stage, awaitable):
+        """Awaits ``awaitable``, recording how long it took as ``stage``."""
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.durations[stage] = time.perf_counter() - started
+
+    def server_timing(self):
+        return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.durations.items())
+
+    def log(self):
+        logger.info('chat_api stages: %s', self.server_timing())
@@ -0,0 +1,101 @@
+"""
+In-process cache of chatbot answers.
+
+The follow-up questions the model suggests are clickable, so many users send
+the exact same strings. Answers are cached per worker, keyed on the
+normalized question, the reply language and a fingerprint of the user
+context. Anonymous users all share one context ("User is not logged in."),
+so their FAQ answers are shared; a logged-in user's context includes their
+cart and orders, which segments the cache per user and per cart state.
+The conversation so far (rolling summary and recent turns) is fingerprinted
+into the key as well, since the model answers a follow-up in its light: the
+opening question of a chat is shared, a follow-up only between identical
+conversations. Requests carrying an uploaded file bypass the cache entirely.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from django.conf import settings
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL = 60 * 60 * 6  # 6 hours
+
+_TRAILING_PUNCTUATION = '?!.।,; '
+
+
+def normalize_question(text):
+    """Casefold, collapse whitespace and drop trailing punctuation."""
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION)
+
+
+def fingerprint(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+def make_key(question, language, context='', history=()):
+    history_json = json.dumps(list(history or ()), sort_keys=True, ensure_ascii=False)
+    raw = '\x1f'.join((normalize_question(question), language or '', fingerprint(context or ''), fingerprint(history_json)))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value), oldest first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+response_cache = ResponseCache(
+    max_entries=getattr(settings, 'CHAT_RESPONSE_CACHE_SIZE', DEFAULT_MAX_ENTRIES),
+    ttl=getattr(settings, 'CHAT_RESPONSE_CACHE_TTL', DEFAULT_TTL),
+)
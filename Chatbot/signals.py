@@ -0,0 +1,34 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from cart.models import CartItem
+from cart.signals import cart_changed
+from products.models import Order
+
+from . import context
+from .models import ChatMessage
+
+
+@receiver(cart_changed)
+def refresh_cart_context(sender, cart_id, **kwargs):
+    context.invalidate_cart(cart_id)
+
+
+@receiver(post_save, sender=CartItem)
+def refresh_cart_item_context(sender, instance, **kwargs):
+    context.invalidate_cart(instance.cart_id)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def refresh_order_context(sender, instance, **kwargs):
+    context.invalidate('orders', user_id=instance.user_id)
+
+
+@receiver(post_save, sender=ChatMessage)
+@receiver(post_delete, sender=ChatMessage)
+def refresh_chat_turns(sender, instance, **kwargs):
+    # Rebuilt from the database on the next read rather than appended in
+    # place: a read-modify-write of the cached list would lose one of two
+    # messages saved at the same time by different workers
+    context.invalidate('turns', instance.user_id, instance.session_id)
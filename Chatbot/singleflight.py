@@ -0,0 +1,155 @@
+"""
+Single-flight coalescing of identical upstream calls.
+
+When many users ask the same popular follow-up, or play the same reply
+aloud, at the same moment, only the first request (the leader) calls Groq or
+Sarvam; the others wait for its result instead of firing their own call.
+
+Within a process this needs no configuration. To coalesce across workers as
+well, point ``SINGLE_FLIGHT_CACHE`` at a cache alias every worker shares
+(Redis, Memcached, the database cache). The leader then takes a lock in that
+cache with ``add()`` and publishes its result there for
+``SINGLE_FLIGHT_RESULT_TIMEOUT`` seconds; other workers poll for it and go
+ahead themselves if the lock disappears without a result (the leader failed)
+or ``SINGLE_FLIGHT_LOCK_TIMEOUT`` passes.
+"""
+import asyncio
+import threading
+import weakref
+
+from django.conf import settings
+from django.core.cache import caches
+
+POLL_INTERVAL = 0.05
+_missing = object()
+
+
+def shared_cache():
+    alias = getattr(settings, 'SINGLE_FLIGHT_CACHE', None)
+    return caches[alias] if alias else None
+
+
+class _Broadcast:
+    """Chunks of one in-flight stream, replayed to everyone subscribed to it."""
+
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.changed = asyncio.Condition()
+
+    async def publish(self, chunk=None, finished=False, error=None):
+        async with self.changed:
+            if chunk is not None:
+                self.chunks.append(chunk)
+            self.finished = self.finished or finished
+            self.error = self.error or error
+            self.changed.notify_all()
+
+    async def subscribe(self):
+        position = 0
+        while True:
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            async with self.changed:
+                await self.changed.wait_for(lambda: len(self.chunks) > position or self.finished)
+
+
+class SingleFlight:
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._loop_flights = weakref.WeakKeyDictionary()  # event loop -> {key: task or _Broadcast}
+
+    def _flights(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            return self._loop_flights.setdefault(loop, {})
+
+    def _forget(self, flights, key):
+        """Done-callback removing a finished flight for ``key``."""
+        def callback(task):
+            flights.pop(key, None)
+            if not task.cancelled():
+                task.exception()  # retrieved here in case every caller left
+        return callback
+
+    def _keys(self, key):
+        prefix = f'chatbot:singleflight:{self.namespace}:{key}'
+        return f'{prefix}:lock', f'{prefix}:result'
+
+    async def ado(self, key, func, share=bool):
+        """
+        Awaits ``func()`` (a coroutine function) once for all concurrent
+        callers asking for ``key``. Results for which ``share(result)`` is
+        false (failures) are not handed to other workers.
+        """
+        flights = self._flights()
+        task = flights.get(key)
+        if task is None:
+            task = flights[key] = asyncio.ensure_future(self._lead(key, func, share))
+            task.add_done_callback(self._forget(flights, key))
+        # A caller that goes away must not cancel the call for the others
+        return await asyncio.shield(task)
+
+    async def _lead(self, key, func, share):
+        cache = shared_cache()
+        if cache is None:
+            return await func()
+
+        lock_key, result_key = self._keys(key)
+        lock_timeout = getattr(settings, 'SINGLE_FLIGHT_LOCK_TIMEOUT', 60)
+        loop = asyncio.get_running_loop()
+        give_up_at = loop.time() + lock_timeout
+        while True:
+            result = await cache.aget(result_key, _missing)
+            if result is not _missing:
+                return result
+            if await cache.aadd(lock_key, True, lock_timeout):
+                try:
+                    result = await func()
+                    if share(result):
+                        await cache.aset(result_key, result, getattr(settings, 'SINGLE_FLIGHT_RESULT_TIMEOUT', 30))
+                    return result
+                finally:
+                    await cache.adelete(lock_key)
+            if loop.time() >= give_up_at:
+                return await func()
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def astream(self, key, stream, share=bool):
+        """
+        Yields the chunks of ``stream()`` (an async generator function),
+        running it once for all concurrent callers asking for ``key``; a
+        caller that joins late first gets the chunks sent so far. Across
+        workers, followers receive the leader's full text as one chunk.
+        """
+        flights = self._flights()
+        broadcast = flights.get(key)
+        if broadcast is None:
+            broadcast = flights[key] = _Broadcast()
+            pump = asyncio.ensure_future(self._pump(key, stream, share, broadcast))
+            pump.add_done_callback(self._forget(flights, key))
+        async for chunk in broadcast.subscribe():
+            yield chunk
+
+    async def _pump(self, key, stream, share, broadcast):
+        async def relay():
+            async for chunk in stream():
+                await broadcast.publish(chunk)
+            return ''.join(broadcast.chunks)
+
+        try:
+            text = await self._lead(key, relay, share)
+            if text and not broadcast.chunks:
+                # Another worker streamed it; only its full text is shared
+                await broadcast.publish(text)
+        except Exception as e:
+            await broadcast.publish(error=e)
+        finally:
+            await broadcast.publish(finished=True)
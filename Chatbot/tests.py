@@ -1,3 +1,957 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from cart.models import Cart, CartItem
+from products.models import Category, Order, Product
+
+from .clients import registry
+from .images import prepare_image
+from .guards import GuardStore, UpstreamUnavailable, store
+from .hedging import LatencyTracker, hedge_delay
+from .documents import chunk_pages, document_context, extract_pdf_pages, select_chunks
+from .context import MAX_TURNS, _load_turns, get_snapshot
+from .history import (
+    FOLD_BATCH_TURNS, MAX_KEPT_TURNS, _fold_in_worker, _in_flight, build_history, count_tokens, fold_turns, select_history,
+)
+from .jobs import INTERRUPTED, fail_stale_jobs, run_transcription
+from .models import ChatMessage, ConversationSummary, TranscriptionJob
+from .singleflight import SingleFlight
+from .response_cache import ResponseCache, make_key, response_cache
+from .tts_cache import TTSCache
+from .utils import (
+    BUSY_MESSAGE, CONNECTION_MESSAGE, aextract_text_from_image, aget_groq_response, astream_groq_response,
+)
+
+
+class FakeUpstream:
+    """
+    Local stand-in for an upstream API. ``routes`` maps a path to a handler
+    returning (status, headers, body); the body may be a list of chunks to
+    stream. Records each request's path, JSON body and client port. Gets
+    its own upstream guard file, so breaker state never leaks between tests.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = []
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real APIs
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                upstream.requests.append({'path': self.path, 'json': payload, 'port': self.client_address[1]})
+                status, headers, body = upstream.routes[self.path](payload)
+                chunks = body if isinstance(body, list) else [body]
+                data = b''.join(chunk.encode() if isinstance(chunk, str) else chunk for chunk in chunks)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 64  # the async tests open many connections at once
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        # Hedged attempts that lost the race hang up before the reply is written
+        self.server.handle_error = lambda request, client_address: None
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def __enter__(self):
+        self.guard_dir = tempfile.mkdtemp()
+        self.guard_settings = override_settings(UPSTREAM_GUARD_PATH=os.path.join(self.guard_dir, 'guards.sqlite3'))
+        self.guard_settings.enable()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        registry.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.guard_settings.disable()
+        shutil.rmtree(self.guard_dir, ignore_errors=True)
+
+    @property
+    def connections(self):
+        return {request['port'] for request in self.requests}
+
+
+def completion(payload):
+    body = {'choices': [{'message': {'content': f"answer from {payload['model']}"}}]}
+    return 200, {'Content-Type': 'application/json'}, json.dumps(body)
+
+
+def streamed_completion(payload):
+    events = [
+        'data: ' + json.dumps({'choices': [{'delta': {'content': token}}]}) + '\n\n'
+        for token in ('Drink ', 'plenty of ', 'water.')
+    ]
+    return 200, {'Content-Type': 'text/event-stream'}, events + ['data: [DONE]\n\n']
+
+
+class ClientRegistryTests(SimpleTestCase):
+    async def test_groq_calls_reuse_one_pooled_connection(self):
+        with FakeUpstream({'/chat/completions': completion}) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url):
+                first = await aget_groq_response('Bukhar mein kya khana chahiye?')
+                second = await aget_groq_response('Bukhar kitne din rehta hai?')
+                await registry.aclose()
+
+        self.assertEqual(first, 'answer from llama-3.3-70b-versatile')
+        self.assertEqual(second, 'answer from llama-3.3-70b-versatile')
+        self.assertEqual(len(upstream.requests), 2)
+        self.assertEqual(len(upstream.connections), 1)
+
+    async def test_streaming_uses_the_pool(self):
+        with FakeUpstream({'/chat/completions': streamed_completion}) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url):
+                tokens = [token async for token in astream_groq_response('Dehydration se kaise bachein?')]
+                await registry.aclose()
+
+        self.assertEqual(''.join(tokens), 'Drink plenty of water.')
+        self.assertTrue(upstream.requests[0]['json']['stream'])
+
+    @mock.patch.dict(os.environ, {'GROQ_API_KEY': 'test-key'})
+    def test_registry_returns_shared_clients(self):
+        self.assertIs(registry.http('groq'), registry.http('groq'))
+        self.assertIsNot(registry.http('groq'), registry.http('sarvam'))
+        # SDK clients are built on top of the same pools
+        self.assertIs(registry.groq()._client, registry.http('groq'))
+        self.assertIs(registry.groq(), registry.groq())
+        registry.close()
+
+
+def models_chain(primary_timeout=5, hedge_after=0.2):
+    return [
+        {'model': 'primary', 'timeout': primary_timeout, 'hedge_after': hedge_after},
+        {'model': 'fallback', 'timeout': 5, 'hedge_after': 5},
+    ]
+
+
+def routed_by_model(**handlers):
+    """A /chat/completions handler that dispatches on the requested model."""
+    return lambda payload: handlers[payload['model']](payload)
+
+
+def slow(seconds, handler=completion):
+    def respond(payload):
+        time.sleep(seconds)
+        return handler(payload)
+    return respond
+
+
+def rate_limited(payload):
+    return 429, {'Content-Type': 'application/json'}, '{}'
+
+
+class HedgingTests(SimpleTestCase):
+    async def ask(self, chain, **handlers):
+        with FakeUpstream({'/chat/completions': routed_by_model(**handlers)}) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url, GROQ_MODEL_CHAIN=chain):
+                started = time.monotonic()
+                answer = await aget_groq_response('Sir dard ki dawa?')
+                elapsed = time.monotonic() - started
+                await registry.aclose()
+                return answer, elapsed, upstream
+
+    async def test_slow_primary_is_hedged_and_fallback_wins(self):
+        answer, elapsed, upstream = await self.ask(models_chain(), primary=slow(2), fallback=completion)
+
+        self.assertEqual(answer, 'answer from fallback')
+        self.assertLess(elapsed, 1.5)
+        self.assertEqual([r['json']['model'] for r in upstream.requests], ['primary', 'fallback'])
+
+    async def test_fast_primary_is_not_hedged(self):
+        answer, _, upstream = await self.ask(models_chain(), primary=completion, fallback=completion)
+
+        self.assertEqual(answer, 'answer from primary')
+        self.assertEqual(len(upstream.requests), 1)
+
+    async def test_rate_limit_switches_immediately(self):
+        answer, elapsed, _ = await self.ask(models_chain(hedge_after=5), primary=rate_limited, fallback=completion)
+
+        self.assertEqual(answer, 'answer from fallback')
+        self.assertLess(elapsed, 1)
+
+    async def test_all_models_failing_reports_the_primary_error(self):
+        answer, _, _ = await self.ask(models_chain(), primary=rate_limited, fallback=rate_limited)
+
+        self.assertEqual(answer, BUSY_MESSAGE)
+
+    async def test_model_timeout_caps_latency(self):
+        chain = [{'model': 'primary', 'timeout': 0.3, 'hedge_after': 0.3}]
+        answer, elapsed, _ = await self.ask(chain, primary=slow(2))
+
+        self.assertEqual(answer, CONNECTION_MESSAGE)
+        self.assertLess(elapsed, 1.5)
+
+    def test_hedge_delay_follows_observed_percentile(self):
+        tracker = LatencyTracker()
+        for i in range(100):
+            tracker.record('primary', i / 100)
+
+        self.assertIsNone(LatencyTracker().percentile('primary', 0.95))
+        self.assertEqual(tracker.percentile('primary', 0.95), 0.95)
+        with mock.patch('Chatbot.hedging.latencies', tracker):
+            self.assertEqual(hedge_delay({'model': 'primary', 'timeout': 20, 'hedge_after': 6}), 0.95)
+            self.assertEqual(hedge_delay({'model': 'other', 'timeout': 20, 'hedge_after': 6}), 6)
+
+
+def failing(payload):
+    return 503, {'Content-Type': 'application/json'}, '{}'
+
+
+@override_settings(UPSTREAM_GUARDS={
+    'groq': {'failure_threshold': 2, 'reset_after': 60},
+    'sarvam': {'failure_threshold': 2, 'reset_after': 60},
+})
+class UpstreamGuardTests(SimpleTestCase):
+    chain = [
+        {'model': 'primary', 'timeout': 5, 'hedge_after': 5},
+        {'model': 'fallback', 'timeout': 5, 'hedge_after': 5},
+    ]
+
+    async def test_open_breaker_fails_fast_to_the_fallback(self):
+        routes = {'/chat/completions': routed_by_model(primary=failing, fallback=completion)}
+        with FakeUpstream(routes) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url, GROQ_MODEL_CHAIN=self.chain):
+                for _ in range(2):
+                    await aget_groq_response('Khansi ki dawa?')
+                self.assertEqual(store.state('groq:chat:primary'), 'open')
+
+                answer = await aget_groq_response('Khansi ki dawa?')
+                await registry.aclose()
+
+        self.assertEqual(answer, 'answer from fallback')
+        # The third call never reached the primary
+        self.assertEqual([r['json']['model'] for r in upstream.requests],
+                         ['primary', 'fallback', 'primary', 'fallback', 'fallback'])
+
+    def test_breaker_state_is_shared_between_workers(self):
+        with FakeUpstream({}):
+            other_worker = GuardStore()
+            for _ in range(2):
+                store.acquire('sarvam:tts')
+                store.record_failure('sarvam:tts')
+
+            with self.assertRaises(UpstreamUnavailable) as raised:
+                other_worker.acquire('sarvam:tts')
+        self.assertEqual(raised.exception.reason, 'circuit open')
+
+    def test_half_open_probe_closes_the_breaker(self):
+        with FakeUpstream({}):
+            for _ in range(2):
+                store.acquire('sarvam:stt')
+                store.record_failure('sarvam:stt')
+
+            with mock.patch('Chatbot.guards.time.time', return_value=time.time() + 61):
+                self.assertEqual(store.state('sarvam:stt'), 'half-open')
+                store.acquire('sarvam:stt')  # the probe
+                with self.assertRaises(UpstreamUnavailable):
+                    store.acquire('sarvam:stt')  # others wait for it
+                store.record_success('sarvam:stt')
+            self.assertEqual(store.state('sarvam:stt'), 'closed')
+
+    @override_settings(UPSTREAM_GUARDS={'groq:chat:primary': {'rate': 0.001, 'burst': 2}})
+    async def test_token_bucket_caps_outbound_rate(self):
+        routes = {'/chat/completions': routed_by_model(primary=completion, fallback=completion)}
+        with FakeUpstream(routes) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url, GROQ_MODEL_CHAIN=self.chain):
+                answers = [await aget_groq_response('Khansi ki dawa?') for _ in range(3)]
+                await registry.aclose()
+
+        self.assertEqual(answers, ['answer from primary', 'answer from primary', 'answer from fallback'])
+        self.assertEqual(len(upstream.requests), 3)
+
+    async def test_bad_requests_do_not_trip_the_breaker(self):
+        def bad_request(payload):
+            return 400, {'Content-Type': 'application/json'}, '{}'
+
+        routes = {'/chat/completions': routed_by_model(primary=bad_request, fallback=bad_request)}
+        with FakeUpstream(routes) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url, GROQ_MODEL_CHAIN=self.chain):
+                for _ in range(3):
+                    await aget_groq_response('Khansi ki dawa?')
+                await registry.aclose()
+                self.assertEqual(store.state('groq:chat:primary'), 'closed')
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def test_key_ignores_case_spacing_and_trailing_punctuation(self):
+        self.assertEqual(
+            make_key('Bukhar mein kya khana chahiye?', 'Hinglish', 'User is not logged in.'),
+            make_key('  bukhar  mein KYA khana chahiye ', 'Hinglish', 'User is not logged in.'),
+        )
+        self.assertNotEqual(
+            make_key('Bukhar mein kya khana chahiye?', 'Hinglish'),
+            make_key('Bukhar mein kya khana chahiye?', 'Hindi'),
+        )
+        self.assertNotEqual(
+            make_key('What is in my cart?', 'English', 'User: asha\nCurrent Cart: Empty\n'),
+            make_key('What is in my cart?', 'English', 'User: ravi\nCurrent Cart: Empty\n'),
+        )
+
+    def test_key_includes_the_conversation_so_far(self):
+        fever = [{'role': 'user', 'content': 'Bukhar hai'}, {'role': 'assistant', 'content': 'Paracetamol lein.'}]
+        cough = [{'role': 'user', 'content': 'Khansi hai'}, {'role': 'assistant', 'content': 'Bhaap lein.'}]
+        question = 'Kitni baar lena chahiye?'
+
+        self.assertEqual(make_key(question, 'Hinglish', '', fever), make_key(question, 'Hinglish', '', list(fever)))
+        self.assertNotEqual(make_key(question, 'Hinglish', '', fever), make_key(question, 'Hinglish', '', cough))
+        self.assertNotEqual(make_key(question, 'Hinglish', '', fever), make_key(question, 'Hinglish'))
+
+    def test_lru_eviction_and_counters(self):
+        cache = ResponseCache(max_entries=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')  # 'b' is now least recently used
+        cache.set('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        cache = ResponseCache(ttl=60)
+        with mock.patch('Chatbot.response_cache.time.monotonic', return_value=1000):
+            cache.set('a', 1)
+        with mock.patch('Chatbot.response_cache.time.monotonic', return_value=1061):
+            self.assertIsNone(cache.get('a'))
+
+
+class ChatApiCacheTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+
+    def ask(self, message):
+        return self.client.post(
+            '/chatbot/api/chat/',
+            json.dumps({'message': message, 'language': 'Hinglish'}),
+            content_type='application/json',
+        )
+
+    def test_repeated_question_is_answered_from_cache(self):
+        with FakeUpstream({'/chat/completions': completion}) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url):
+                registry.close()
+                first = self.ask('Bukhar mein kya khana chahiye?')
+                self.client.cookies.clear()  # another visitor, same opening question
+                second = self.ask('bukhar mein kya khana chahiye')
+
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(len(upstream.requests), 1)
+
+    def test_follow_ups_are_not_shared_across_conversations(self):
+        def answer_in_context(payload):
+            earlier = ' '.join(m['content'] for m in payload['messages'][1:-1])
+            text = 'Din mein 3 baar.' if 'Bukhar' in earlier else 'Din mein 2 baar.'
+            body = {'choices': [{'message': {'content': text}}]}
+            return 200, {'Content-Type': 'application/json'}, json.dumps(body)
+
+        answers = {}
+        with FakeUpstream({'/chat/completions': answer_in_context}) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url):
+                registry.close()
+                for opening in ('Bukhar hai', 'Khansi hai'):
+                    self.client.cookies.clear()  # a new anonymous session
+                    self.ask(opening)
+                    follow_up = self.ask('Kitni baar lena chahiye?')
+                    self.assertEqual(follow_up['X-Cache'], 'MISS')
+                    answers[opening] = follow_up.json()['response']
+
+        self.assertIn('3 baar', answers['Bukhar hai'])
+        self.assertIn('2 baar', answers['Khansi hai'])
+        self.assertEqual(len(upstream.requests), 4)
+
+    def test_errors_are_not_cached(self):
+        def overloaded(payload):
+            return 503, {}, 'busy'
+
+        with FakeUpstream({'/chat/completions': overloaded}) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url):
+                registry.close()
+                self.ask('Bukhar mein kya khana chahiye?')
+                retry = self.ask('Bukhar mein kya khana chahiye?')
+
+        self.assertEqual(retry['X-Cache'], 'MISS')
+        # Each ask tries the primary and the fallback model
+        self.assertEqual(len(upstream.requests), 4)
+
+
+class AsyncChatTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+
+    async def test_one_event_loop_holds_many_chats_in_flight(self):
+        routes = {'/chat/completions': slow(0.5)}
+        with FakeUpstream(routes) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url, UPSTREAM_GUARDS={'groq': {'burst': 50}}):
+                started = time.monotonic()
+                answers = await asyncio.gather(*[aget_groq_response(f'Sawaal {i}') for i in range(20)])
+                elapsed = time.monotonic() - started
+                await registry.aclose()
+
+        self.assertEqual(set(answers), {'answer from llama-3.3-70b-versatile'})
+        self.assertLess(elapsed, 2)  # 20 x 0.5s upstream calls, overlapped
+
+    async def test_hedged_loser_is_cancelled(self):
+        with FakeUpstream({'/chat/completions': routed_by_model(primary=slow(2), fallback=completion)}) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url, GROQ_MODEL_CHAIN=models_chain()):
+                started = time.monotonic()
+                answer = await aget_groq_response('Sir dard ki dawa?')
+                elapsed = time.monotonic() - started
+                await registry.aclose()
+
+        self.assertEqual(answer, 'answer from fallback')
+        self.assertLess(elapsed, 1.5)
+
+    async def test_streamed_chat_is_saved(self):
+        with FakeUpstream({'/chat/completions': streamed_completion}) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url):
+                response = await self.async_client.post(
+                    '/chatbot/api/chat/', {'message': 'Garmi mein kya karein?', 'stream': True},
+                    content_type='application/json',
+                )
+                body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+                await registry.aclose()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn('"response": "Drink plenty of water."', body)
+        saved = [m async for m in ChatMessage.objects.order_by('id').values_list('role', 'message')]
+        self.assertEqual(saved, [('user', 'Garmi mein kya karein?'), ('assistant', 'Drink plenty of water.')])
+
+    async def test_streamed_chat_is_hedged_on_the_first_token(self):
+        handler = routed_by_model(primary=slow(2, streamed_completion), fallback=streamed_completion)
+        with FakeUpstream({'/chat/completions': handler}) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url, GROQ_MODEL_CHAIN=models_chain()):
+                started = time.monotonic()
+                response = await self.async_client.post(
+                    '/chatbot/api/chat/', {'message': 'Garmi mein kya karein?', 'stream': True},
+                    content_type='application/json',
+                )
+                body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+                elapsed = time.monotonic() - started
+                await registry.aclose()
+
+        self.assertLess(elapsed, 1.5)
+        self.assertEqual([r['json']['model'] for r in upstream.requests], ['primary', 'fallback'])
+        # Only the fallback's stream reaches the browser
+        self.assertEqual(body.count('"token": "Drink "'), 1)
+        self.assertIn('"response": "Drink plenty of water."', body)
+
+
+class ChatPipelineTests(TestCase):
+    def test_attachment_and_context_are_built_concurrently(self):
+        async def slow_ocr(image_bytes):
+            await asyncio.sleep(0.5)
+            return 'Tab. Dolo 650'
+
+        def slow_snapshot(**owner):
+            time.sleep(0.5)
+            return get_snapshot(**owner)
+
+        photo = SimpleUploadedFile('rx.jpg', phone_photo(size=(40, 30)), content_type='image/jpeg')
+        with FakeUpstream({'/chat/completions': completion}) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url), \
+                    mock.patch('Chatbot.views.aextract_text_from_image', slow_ocr), \
+                    mock.patch('Chatbot.context.get_snapshot', slow_snapshot):
+                started = time.monotonic()
+                response = self.client.post('/chatbot/api/chat/', {'message': 'Ye kya hai?', 'file': photo})
+                elapsed = time.monotonic() - started
+
+        self.assertEqual(response.json(), {'response': 'answer from llama-3.3-70b-versatile'})
+        self.assertLess(elapsed, 0.9)  # max(OCR, DB), not the sum
+        stages = [part.split(';')[0] for part in response['Server-Timing'].split(', ')]
+        self.assertEqual(sorted(stages), ['completion', 'context', 'file'])
+        system_prompt = upstream.requests[0]['json']['messages'][0]['content']
+        self.assertIn('USER UPLOADED FILE CONTENT (rx.jpg):\nTab. Dolo 650', system_prompt)
+
+
+WAV = b'RIFF' + bytes(range(96))
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+
+    async def test_concurrent_identical_questions_share_one_stream(self):
+        def slow_stream(payload):
+            time.sleep(0.3)
+            return streamed_completion(payload)
+
+        async def ask():
+            response = await self.async_client.post(
+                '/chatbot/api/chat/', {'message': 'Lu se kaise bachein?', 'stream': True},
+                content_type='application/json',
+            )
+            return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        with FakeUpstream({'/chat/completions': slow_stream}) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url):
+                bodies = await asyncio.gather(*[ask() for _ in range(5)])
+                await registry.aclose()
+
+        self.assertEqual(len(upstream.requests), 1)
+        for body in bodies:
+            self.assertIn('"response": "Drink plenty of water."', body)
+
+    async def test_failures_are_not_shared(self):
+        flight = SingleFlight('test')
+        calls = []
+
+        async def flaky():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return None
+
+        # Concurrent callers share even a failed call...
+        self.assertEqual(await asyncio.gather(flight.ado('k', flaky), flight.ado('k', flaky)), [None, None])
+        self.assertEqual(len(calls), 1)
+        # ...but the next caller tries again
+        await flight.ado('k', flaky)
+        self.assertEqual(len(calls), 2)
+
+    @override_settings(
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'single-flight'},
+        },
+        SINGLE_FLIGHT_CACHE='shared',
+    )
+    async def test_workers_coalesce_through_the_shared_cache(self):
+        # Two instances stand in for two worker processes
+        first_worker, second_worker = SingleFlight('tts'), SingleFlight('tts')
+        calls = []
+
+        async def synthesize():
+            calls.append(1)
+            await asyncio.sleep(0.2)
+            return WAV
+
+        results = await asyncio.gather(first_worker.ado('clip', synthesize), second_worker.ado('clip', synthesize))
+
+        self.assertEqual(results, [WAV, WAV])
+        self.assertEqual(len(calls), 1)
+
+
+class TextToSpeechTests(SimpleTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        self.settings_override = override_settings(TTS_CACHE_DIR=self.cache_dir)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def speak(self, text, **headers):
+        return self.client.post('/chatbot/api/tts/', json.dumps({'text': text}), content_type='application/json', **headers)
+
+    @mock.patch('Chatbot.utils.agenerate_audio', return_value=WAV)
+    def test_replays_are_served_from_disk_as_raw_wav(self, generate_audio):
+        first = self.speak('Paani zyada piyein.')
+        second = self.speak('Paani zyada piyein.')
+
+        self.assertEqual(generate_audio.call_count, 1)
+        for response in (first, second):
+            self.assertEqual(response['Content-Type'], 'audio/wav')
+            self.assertEqual(response['Content-Length'], str(len(WAV)))
+            self.assertEqual(b''.join(response.streaming_content), WAV)
+
+        replay = self.client.get(second['Content-Location'])
+        self.assertEqual(b''.join(replay.streaming_content), WAV)
+
+    @mock.patch('Chatbot.utils.agenerate_audio', return_value=WAV)
+    def test_range_requests(self, generate_audio):
+        url = self.speak('Paani zyada piyein.')['Content-Location']
+
+        partial = self.client.get(url, HTTP_RANGE='bytes=4-11')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial.content, WAV[4:12])
+        self.assertEqual(partial['Content-Range'], f'bytes 4-11/{len(WAV)}')
+
+        tail = self.client.get(url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(tail.content, WAV[-10:])
+
+        beyond = self.client.get(url, HTTP_RANGE=f'bytes={len(WAV)}-')
+        self.assertEqual(beyond.status_code, 416)
+
+    @mock.patch('Chatbot.utils.agenerate_audio', return_value=WAV)
+    def test_player_posts_for_one_byte_and_streams_the_rest(self, generate_audio):
+        # What the chat page does: synthesize without downloading the clip
+        response = self.speak('Paani zyada piyein.', HTTP_RANGE='bytes=0-0')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, WAV[:1])
+
+        played = self.client.get(response['Content-Location'], HTTP_RANGE='bytes=0-')
+        self.assertEqual(played.content, WAV)
+        self.assertEqual(generate_audio.call_count, 1)
+
+    def test_least_recently_played_clips_are_evicted(self):
+        cache = TTSCache(directory=self.cache_dir, max_bytes=3 * len(WAV))
+        for age, key in enumerate(('a' * 64, 'b' * 64, 'c' * 64)):
+            cache.put(key, WAV)
+            os.utime(cache.path(key), (1000 + age, 1000 + age))
+        cache.open('a' * 64).close()  # played again, so 'b' is now the oldest
+
+        cache.put('d' * 64, WAV)  # one clip over the bound
+
+        self.assertFalse(os.path.exists(cache.path('b' * 64)))
+        for key in ('a' * 64, 'c' * 64, 'd' * 64):
+            self.assertTrue(os.path.exists(cache.path(key)))
+
+
+class TranscriptionJobTests(TestCase):
+    def submit(self):
+        audio = SimpleUploadedFile('recording.webm', b'voice note', content_type='audio/webm')
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/chatbot/api/transcribe/', {'audio': audio, 'language': 'Hindi'})
+        self.assertEqual(len(callbacks), 1)  # queued for the worker pool, not run inline
+        return response
+
+    @mock.patch('Chatbot.jobs.transcribe_audio', return_value='Sir mein dard hai')
+    def test_submit_then_poll(self, transcribe_audio):
+        response = self.submit()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'pending')
+        transcribe_audio.assert_not_called()
+
+        status_url = response.json()['status_url']
+        self.assertEqual(self.client.get(status_url).json()['status'], 'pending')
+
+        job = run_transcription(response.json()['job_id'])
+        transcribe_audio.assert_called_once_with(job.audio_path, language_code='hi-IN')
+        self.assertFalse(os.path.exists(job.audio_path))
+        self.assertEqual(self.client.get(status_url).json(), {
+            'job_id': str(job.id), 'status': 'done', 'text': 'Sir mein dard hai',
+        })
+
+    @mock.patch('Chatbot.jobs.transcribe_audio', return_value=None)
+    def test_failed_job(self, transcribe_audio):
+        response = self.submit()
+        run_transcription(response.json()['job_id'])
+
+        data = self.client.get(response.json()['status_url']).json()
+        self.assertEqual(data['status'], 'failed')
+        self.assertEqual(data['error'], 'Transcription failed')
+
+    def test_jobs_lost_with_their_worker_are_failed_when_polled(self):
+        response = self.submit()
+        status_url = response.json()['status_url']
+        job = TranscriptionJob.objects.get(pk=response.json()['job_id'])
+
+        # Never picked up: the process holding the pool was restarted
+        TranscriptionJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(seconds=599))
+        self.assertEqual(self.client.get(status_url).json()['status'], 'pending')
+        TranscriptionJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(seconds=601))
+
+        self.assertEqual(self.client.get(status_url).json(), {
+            'job_id': str(job.id), 'status': 'failed', 'error': INTERRUPTED,
+        })
+        self.assertFalse(os.path.exists(job.audio_path))
+
+    @override_settings(TRANSCRIPTION_STALE_AFTER=60)
+    def test_fail_stale_jobs_leaves_recent_and_finished_jobs(self):
+        old = timezone.now() - timedelta(minutes=5)
+        stale = TranscriptionJob.objects.create(audio_path='/nonexistent.webm', status='running')
+        finished = TranscriptionJob.objects.create(audio_path='/nonexistent.webm', status='done', text='ok')
+        TranscriptionJob.objects.filter(pk__in=[stale.pk, finished.pk]).update(updated_at=old)
+        recent = TranscriptionJob.objects.create(audio_path='/nonexistent.webm')
+
+        self.assertEqual(fail_stale_jobs(), 1)
+        self.assertEqual(
+            dict(TranscriptionJob.objects.values_list('pk', 'status')),
+            {stale.pk: 'failed', finished.pk: 'done', recent.pk: 'pending'},
+        )
+
+    def test_jobs_are_private_to_their_session(self):
+        response = self.submit()
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get(response.json()['status_url']).status_code, 404)
+
+
+class ContextSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('asha', 'asha@example.com', 'pw', first_name='Asha')
+        category = Category.objects.create(name='Fever', slug='fever')
+        self.product = Product.objects.create(category=category, name='Paracetamol', slug='paracetamol', description='', price=Decimal('20.00'), stock=10)
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+
+    def test_warm_snapshot_needs_no_queries(self):
+        snapshot = get_snapshot(user_id=self.user.pk, cart_id=self.cart.pk)
+        self.assertEqual(snapshot['cart']['lines'], [(2, 'Paracetamol', '40.00')])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_snapshot(user_id=self.user.pk, cart_id=self.cart.pk), snapshot)
+
+    def test_signals_refresh_the_snapshot(self):
+        get_snapshot(user_id=self.user.pk, cart_id=self.cart.pk)
+
+        self.client.force_login(self.user)
+        self.client.get(f'/cart/remove/{self.cart.items.get().pk}/')
+        Order.objects.create(user=self.user, total_price=Decimal('40.00'), shipping_address='Pune')
+        message = ChatMessage.objects.create(user=self.user, message='Bukhar hai', role='user')
+
+        snapshot = get_snapshot(user_id=self.user.pk, cart_id=self.cart.pk)
+        self.assertEqual(snapshot['cart']['lines'], [])
+        self.assertEqual(snapshot['orders'][0][1:3], ('pending', '40.00'))
+        self.assertEqual(snapshot['turns'], [{'id': message.pk, 'role': 'user', 'content': 'Bukhar hai'}])
+
+    def test_price_change_refreshes_cart_lines(self):
+        get_snapshot(user_id=self.user.pk, cart_id=self.cart.pk)
+        self.product.price = Decimal('25.00')
+        self.product.save()
+
+        self.assertEqual(get_snapshot(user_id=self.user.pk, cart_id=self.cart.pk)['cart']['total'], '50.00')
+
+    def test_chatting_does_not_create_a_cart(self):
+        self.cart.delete()
+        self.client.force_login(self.user)
+        with FakeUpstream({'/chat/completions': completion}) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url):
+                registry.close()
+                response = self.client.post(
+                    '/chatbot/api/chat/', json.dumps({'message': 'Mera cart?'}), content_type='application/json',
+                )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Current Cart: Empty', upstream.requests[0]['json']['messages'][0]['content'])
+        self.assertFalse(Cart.objects.exists())
+
+    def test_new_messages_rebuild_the_last_turns(self):
+        get_snapshot(session_id='abc')
+        for n in range(MAX_TURNS + 2):
+            ChatMessage.objects.create(session_id='abc', message=f'message {n}', role='user')
+
+        with self.assertNumQueries(1):
+            turns = get_snapshot(session_id='abc')['turns']
+        with self.assertNumQueries(0):
+            self.assertEqual(get_snapshot(session_id='abc')['turns'], turns)
+        self.assertEqual(len(turns), MAX_TURNS)
+        self.assertEqual(turns[-1]['content'], f'message {MAX_TURNS + 1}')
+        self.assertEqual(turns, _load_turns(session_id='abc'))
+
+
+def turn(pk, content, role='user'):
+    return {'id': pk, 'role': role, 'content': content}
+
+
+class HistoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_newest_turns_fill_the_budget(self):
+        turns = [turn(n, 'x' * 400) for n in range(1, 7)]  # ~104 tokens each
+        kept, to_fold = select_history(turns, {'text': '', 'through': 0}, budget=320)
+
+        self.assertEqual([t['id'] for t in kept], [4, 5, 6])
+        self.assertEqual([t['id'] for t in to_fold], [1, 2, 3])
+
+    def test_summarized_turns_are_skipped_and_summary_counts(self):
+        turns = [turn(n, 'x' * 400) for n in range(1, 7)]
+        summary = {'text': 'y' * 400, 'through': 2}
+        kept, to_fold = select_history(turns, summary, budget=320)
+
+        self.assertEqual([t['id'] for t in kept], [5, 6])
+        self.assertEqual([t['id'] for t in to_fold], [3, 4])
+
+    def test_a_pasted_document_is_folded_not_sent(self):
+        turns = [turn(1, 'short question'), turn(2, 'pdf ' * 5000, role='assistant')]
+        kept, to_fold = select_history(turns, {'text': '', 'through': 0}, budget=1500)
+
+        self.assertEqual(kept, [])
+        self.assertEqual(len(to_fold), 2)
+        self.assertGreater(count_tokens('नमस्ते'), count_tokens('hello'))
+
+    def test_folding_stores_a_rolling_summary(self):
+        def summarizer(payload):
+            self.assertIn('Bukhar hai', payload['messages'][0]['content'])
+            body = {'choices': [{'message': {'content': 'User has a fever.'}}]}
+            return 200, {'Content-Type': 'application/json'}, json.dumps(body)
+
+        with FakeUpstream({'/chat/completions': summarizer}) as upstream:
+            with override_settings(GROQ_BASE_URL=upstream.url):
+                registry.close()
+                fold_turns('session:abc', {'text': '', 'through': 0}, [turn(3, 'Bukhar hai')])
+
+        self.assertEqual(upstream.requests[0]['json']['model'], 'llama-3.1-8b-instant')
+        stored = ConversationSummary.objects.get(owner='session:abc')
+        self.assertEqual((stored.summary, stored.through), ('User has a fever.', 3))
+
+        history = build_history(get_snapshot(session_id='abc'), session_id='abc')
+        self.assertEqual(history[0]['role'], 'system')
+        self.assertIn('User has a fever.', history[0]['content'])
+
+    @mock.patch('Chatbot.history.executor')
+    def test_overflow_is_folded_in_the_background(self, executor):
+        snapshot = {'turns': [turn(1, 'x' * 8000), turn(2, 'short')], 'summary': {'text': '', 'through': 0}}
+        history = build_history(snapshot, session_id='abc')
+        self.addCleanup(_in_flight.discard, 'session:abc')  # the mocked pool never finishes
+
+        self.assertEqual(history, [{'role': 'user', 'content': 'short'}])
+        executor.submit.assert_called_once()
+        self.assertEqual(executor.submit.call_args.args[1:], ('session:abc', snapshot['summary'], [turn(1, 'x' * 8000)]))
+
+    @mock.patch('Chatbot.history.executor')
+    def test_a_small_overflow_rides_along_until_a_batch_is_due(self, executor):
+        turns = [turn(n, f'message {n}') for n in range(1, MAX_KEPT_TURNS + 3)]
+        history = build_history({'turns': turns, 'summary': {'text': '', 'through': 0}}, session_id='abc')
+
+        self.assertEqual([m['content'] for m in history], [t['content'] for t in turns])
+        executor.submit.assert_not_called()
+
+    @mock.patch('Chatbot.history.connections')
+    @mock.patch('Chatbot.history.executor')
+    def test_consecutive_turns_are_folded_in_batches(self, executor, connections):
+        executor.submit.side_effect = lambda fn, *args: fn(*args)
+        messages = []
+        with mock.patch('Chatbot.history.summarize_conversation', return_value='Earlier chat.') as summarize:
+            for n in range(1, 21):
+                messages.append(turn(n, f'message {n}', role='user' if n % 2 else 'assistant'))
+                snapshot = {'turns': messages[-MAX_TURNS:], 'summary': get_snapshot(session_id='abc')['summary']}
+                # Every turn is either summarized or still in the ring buffer
+                self.assertLessEqual(snapshot['turns'][0]['id'], snapshot['summary']['through'] + 1)
+                build_history(snapshot, session_id='abc')
+
+        self.assertLess(summarize.call_count, 20 // FOLD_BATCH_TURNS + 1)
+        self.assertTrue(all(len(call.args[1]) >= FOLD_BATCH_TURNS for call in summarize.call_args_list))
+
+    @mock.patch('Chatbot.history.connections')  # the worker closes its connections; keep the test's
+    @mock.patch('Chatbot.history.executor')
+    def test_turns_stay_in_the_prompt_until_a_fold_succeeds(self, executor, connections):
+        snapshot = {'turns': [turn(1, 'x' * 8000), turn(2, 'short')], 'summary': {'text': '', 'through': 0}}
+
+        def fold_in_background():
+            _fold_in_worker(*executor.submit.call_args.args[1:])
+
+        with mock.patch('Chatbot.history.summarize_conversation', return_value=None):
+            self.assertEqual(len(build_history(snapshot, session_id='abc')), 1)
+            fold_in_background()
+            history = build_history(snapshot, session_id='abc')
+            self.assertEqual([m['content'] for m in history], ['x' * 8000, 'short'])
+
+        with mock.patch('Chatbot.history.summarize_conversation', return_value='User pasted a long note.'):
+            fold_in_background()
+        snapshot['summary'] = get_snapshot(session_id='abc')['summary']
+        self.assertEqual(snapshot['summary'], {'text': 'User pasted a long note.', 'through': 1})
+        self.assertEqual(build_history(snapshot, session_id='abc'), [
+            {'role': 'system', 'content': 'Summary of the earlier conversation:\nUser pasted a long note.'},
+            {'role': 'user', 'content': 'short'},
+        ])
+
+
+SAMPLE_PDF = os.path.join(settings.BASE_DIR, 'test_chat.pdf')
+
+
+class DocumentIngestionTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def upload(self):
+        with open(SAMPLE_PDF, 'rb') as f:
+            return SimpleUploadedFile('report.pdf', f.read(), content_type='application/pdf')
+
+    def test_pdf_is_extracted_once_then_served_by_hash(self):
+        first = document_context(self.upload(), 'pdf', 'What is the magic number?')
+        self.assertIn('[Page 1]', first)
+        self.assertIn('The magic number is 42.', first)
+
+        with mock.patch('Chatbot.documents._get_pool') as get_pool:
+            again = document_context(self.upload(), 'pdf', 'What is the magic number?')
+        get_pool.assert_not_called()
+        self.assertEqual(again, first)
+
+    def test_extraction_stops_at_the_char_cap(self):
+        pages = extract_pdf_pages(SAMPLE_PDF, max_pages=50, max_chars=10)
+        self.assertEqual(pages, ['This is a '])
+
+    def test_only_relevant_chunks_reach_the_prompt(self):
+        pages = [
+            'Haemoglobin 13.5 g/dL, within the normal range.',
+            'Serum creatinine 2.1 mg/dL is high and suggests reduced kidney function.',
+            'Lipid profile: LDL 96 mg/dL.',
+        ]
+        chunks = chunk_pages(pages)
+        self.assertEqual(len(chunks), 3)
+
+        picked = select_chunks(chunks, 'Is my kidney creatinine okay?', max_chars=80)
+        self.assertEqual([page for page, _text in picked], [2])
+
+        # No question terms in the document: take it from the start
+        self.assertEqual([page for page, _text in select_chunks(chunks, 'hello', max_chars=130)], [1, 2])
+
+
+def phone_photo(size=(4000, 3000), orientation=None):
+    """A JPEG like a phone camera's: large, colour, optionally EXIF-rotated."""
+    image = Image.new('RGB', size, (200, 30, 30))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    output = io.BytesIO()
+    image.save(output, format='JPEG', exif=exif)
+    return output.getvalue()
+
+
+class VisionImageTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_photos_are_rotated_shrunk_and_grayscaled(self):
+        data, mime_type = prepare_image(phone_photo(orientation=6))  # 6 = rotate 90 degrees
+
+        self.assertEqual(mime_type, 'image/jpeg')
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertEqual(image.size, (1200, 1600))
+            self.assertEqual(image.mode, 'L')
+
+    @override_settings(VISION_IMAGE_FORMAT='WEBP', VISION_MAX_SIDE=800)
+    def test_webp_output(self):
+        data, mime_type = prepare_image(phone_photo(size=(400, 300)))
+
+        self.assertEqual(mime_type, 'image/webp')
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertEqual(image.size, (400, 300))  # small images are not upscaled
+
+    async def test_same_photo_is_analyzed_once(self):
+        client = mock.Mock()
+        client.chat.completions.create = mock.AsyncMock()
+        client.chat.completions.create.return_value.choices = [mock.Mock(message=mock.Mock(content=' Tab. Dolo 650 '))]
+        photo = phone_photo()
+
+        with mock.patch('Chatbot.utils.registry.async_groq', return_value=client):
+            self.assertEqual(await aextract_text_from_image(photo), 'Tab. Dolo 650')
+            self.assertEqual(await aextract_text_from_image(photo), 'Tab. Dolo 650')
+
+        client.chat.completions.create.assert_called_once()
+        url = client.chat.completions.create.call_args.kwargs['messages'][0]['content'][1]['image_url']['url']
+        self.assertTrue(url.startswith('data:image/jpeg;base64,'))
+        self.assertLess(len(url), len(photo))
@@ -0,0 +1,97 @@
+"""
+Content-addressed on-disk cache of synthesized speech.
+
+Each clip is stored under the SHA-256 of everything that affects the audio
+(text, language, speaker, pace, sample rate, model), so replaying a message
+never calls Sarvam again and any worker on the host can serve it. The cache
+directory is bounded by ``TTS_CACHE_MAX_BYTES``; once it grows past that the
+least recently played clips are deleted. Reads refresh a clip's mtime, which
+is what eviction orders by.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+
+def speech_key(text, **params):
+    raw = json.dumps({'text': text, **params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    def __init__(self, directory=None, max_bytes=None):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._evict_lock = threading.Lock()
+
+    @property
+    def directory(self):
+        return self._directory or getattr(
+            settings, 'TTS_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'pharmacare-tts')
+        )
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes or getattr(settings, 'TTS_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.wav')
+
+    def open(self, key):
+        """Open the cached clip for reading, or return None on a miss."""
+        path = self.path(key)
+        try:
+            audio_file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass  # evicted meanwhile; the open handle still reads fine
+        return audio_file
+
+    def put(self, key, audio):
+        """Store ``audio`` bytes atomically, then enforce the size bound."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(audio)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """Delete least recently used clips until the cache fits ``max_bytes``."""
+        with self._evict_lock:
+            clips = []
+            for root, _dirs, files in os.walk(self.directory):
+                for name in files:
+                    if not name.endswith('.wav'):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    clips.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _mtime, size, _path in clips)
+            for _mtime, size, path in sorted(clips):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            return total
+
+
+tts_cache = TTSCache()
@@ -10,5 +10,7 @@ urlpatterns = [
     path("product/<slug:slug>/", views.product_detail, name="product_detail"),
     path("api/chat/", views.chat_api, name="chat_api"),
     path("api/tts/", views.text_to_speech_api, name="text_to_speech_api"),
+    path("api/tts/<str:key>/", views.tts_audio, name="tts_audio"),
     path("api/transcribe/", views.transcribe_api, name="transcribe_api"),
+    path("api/transcribe/<uuid:job_id>/", views.transcription_status, name="transcription_status"),
 ]
@@ -1,85 +1,130 @@
 import os
 import json
-import urllib.request
-import urllib.error
+import io
 import base64
-import groq
+import time
+import asyncio
+import httpx
+from django.conf import settings
+from .clients import registry
+from .guards import UpstreamUnavailable, aguarded, guarded
+from .hedging import AttemptTimeout, arace, first_token_latencies, latencies
+from .pipeline import run_blocking
+from .singleflight import SingleFlight
+from .images import aget_vision_result, aset_vision_result, image_data_url, image_digest
+from .tts_cache import speech_key, tts_cache
 
 # Groq API Configuration
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_CHAT_PATH = "/chat/completions"  # relative to the pooled client's GROQ_BASE_URL
 GROQ_MODEL = "llama-3.3-70b-versatile"
+GROQ_FALLBACK_MODEL = "llama-3.1-8b-instant"
+
+# Overridable with settings.GROQ_MODEL_CHAIN. ``timeout`` caps one attempt;
+# ``hedge_after`` is the hedge delay until the model has latency samples.
+DEFAULT_MODEL_CHAIN = [
+    {"model": GROQ_MODEL, "timeout": 20, "hedge_after": 6},
+    {"model": GROQ_FALLBACK_MODEL, "timeout": 10, "hedge_after": 3},
+]
+
+# Identical concurrent upstream calls share one request (see Chatbot.singleflight)
+chat_flights = SingleFlight('chat')
+speech_flights = SingleFlight('tts')
+vision_flights = SingleFlight('vision')
+
+# User-facing replies when Groq fails (never cached as answers)
+BUSY_MESSAGE = "I'm currently receiving too many messages and my backup is also busy. Please try again in 30 seconds."
+UNAVAILABLE_MESSAGE = "My service is temporarily unavailable. Please try again later."
+CONNECTION_MESSAGE = "I'm having trouble connecting to my brain right now. Please try again later."
+UNEXPECTED_MESSAGE = "An unexpected error occurred. Please try again."
+ERROR_MESSAGES = {BUSY_MESSAGE, UNAVAILABLE_MESSAGE, CONNECTION_MESSAGE, UNEXPECTED_MESSAGE}
 
 # Sarvam AI Configuration
 SARVAM_API_KEY = os.getenv("SARVAM_API_KEY")
 
-def generate_audio(text):
+# Text-to-speech settings; all of them are part of the audio cache key
+TTS_LANGUAGE = "hi-IN"
+TTS_SPEAKER = "ritu"
+TTS_PACE = 1.1
+TTS_SAMPLE_RATE = 22050
+TTS_MODEL = "bulbul:v3"
+
+TTS_OPTIONS = {
+    "target_language_code": TTS_LANGUAGE,
+    "speaker": TTS_SPEAKER,
+    "pace": TTS_PACE,
+    "speech_sample_rate": TTS_SAMPLE_RATE,
+    "enable_preprocessing": True,
+    "model": TTS_MODEL,
+}
+
+async def agenerate_audio(text):
     """
-    Generates audio from text using Sarvam AI.
-    Returns: base64 encoded audio string or None on failure.
+    Generates audio from text using Sarvam AI, on the pooled async client.
+    Returns: WAV bytes or None on failure.
     """
     try:
-        # Avoid circular import if possible, or just import here
-        from sarvamai import SarvamAI
-        
-        client = SarvamAI(api_subscription_key=SARVAM_API_KEY)
-        
-        # Determine language code based on text content (rudimentary check)
-        # Using hi-IN as requested/common for this user's context, or defaults. 
-        # Ideally we pass language from the chat context, but for now we default to hi-IN 
-        # as it covers both Hindi and English well with the 'bulbul' model.
-        target_language_code = "hi-IN" 
-        
-        response = client.text_to_speech.convert(
-            text=text,
-            target_language_code=target_language_code,
-            speaker="ritu",
-            pace=1.1,
-            speech_sample_rate=22050,
-            enable_preprocessing=True,
-            model="bulbul:v3"
-        )
-        
-        # The SDK returns a response object with 'audios' list (base64 strings)
-        if response.audios and len(response.audios) > 0:
-            return response.audios[0]
-        
+        async with aguarded('sarvam:tts'):
+            response = await registry.async_sarvam().text_to_speech.convert(text=text, **TTS_OPTIONS)
+        if response.audios:
+            return base64.b64decode(response.audios[0])
         return None
-
     except Exception as e:
         print(f"Error generating audio: {e}")
         return None
 
+def speech_cache_key(text):
+    return speech_key(
+        text, language=TTS_LANGUAGE, speaker=TTS_SPEAKER, pace=TTS_PACE,
+        sample_rate=TTS_SAMPLE_RATE, model=TTS_MODEL,
+    )
+
+async def aget_speech(text):
+    """
+    Returns (cache key, open WAV file) for ``text``, synthesizing it only
+    when it is not in the TTS cache yet. The file is None on failure. The
+    disk cache is read off the event loop.
+    """
+    key = speech_cache_key(text)
+    audio_file = await asyncio.to_thread(tts_cache.open, key)
+    if audio_file is None:
+        audio = await speech_flights.ado(key, lambda: agenerate_audio(text))
+        if not audio:
+            return key, None
+        await asyncio.to_thread(tts_cache.put, key, audio)
+        audio_file = await asyncio.to_thread(tts_cache.open, key) or io.BytesIO(audio)
+    return key, audio_file
+
 def transcribe_audio(audio_file_path, language_code="unknown"):
     """
-    Transcribes audio using Sarvam AI Batch API.
+    Transcribes audio using Sarvam AI Batch API. Blocks until the batch job
+    finishes, so call it from Chatbot.jobs rather than a view.
     Returns: Transcribed text or None.
     """
     try:
-        from sarvamai import SarvamAI
         import tempfile
-        import shutil
-        
-        client = SarvamAI(api_subscription_key=SARVAM_API_KEY)
-        
-        # Create batch job
-        job = client.speech_to_text_job.create_job(
-            model="saaras:v3",
-            mode="transcribe",
-            language_code=language_code, 
-            with_diarization=False, # Not needed for simple dictation
-            num_speakers=1
-        )
         
-        # Upload file
-        job.upload_files(file_paths=[audio_file_path])
-        job.start()
+        client = registry.sarvam()
         
-        # Wait for completion (might take time)
-        # In a real async app we wouldn't block, but here we have to for the simple API
-        job.wait_until_complete()
-        
-        file_results = job.get_file_results()
+        with guarded('sarvam:stt'):
+            # Create batch job
+            job = client.speech_to_text_job.create_job(
+                model="saaras:v3",
+                mode="transcribe",
+                language_code=language_code, 
+                with_diarization=False, # Not needed for simple dictation
+                num_speakers=1
+            )
+            
+            # Upload file
+            job.upload_files(file_paths=[audio_file_path])
+            job.start()
+            
+            # Wait for completion (might take time); this runs on the
+            # Chatbot.jobs worker pool, never in a request thread
+            job.wait_until_complete()
+            
+            file_results = job.get_file_results()
         
         if file_results['successful']:
             # Create a temp dir for output
@@ -128,16 +173,18 @@ def transcribe_audio(audio_file_path, language_code="unknown"):
         print(f"Error transcribing audio: {e}")
         return None
 
-def get_groq_response(message, language="English", context=None, history=None):
-    """
-    Sends a message to the Groq API and returns the response.
-    """
-    headers = {
+def _groq_headers():
+    return {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {GROQ_API_KEY}",
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
     }
 
+def build_groq_messages(message, language="English", context=None, history=None):
+    """
+    Builds the chat completion message list: system prompt (with user
+    context and format rules), prior history, then the user message.
+    """
     base_system_prompt = (
         "You are a warm, polite, and professional female medical assistant for PharmaCare. "
         "Talk like a caring female doctor or pharmacist who puts patients at ease while maintaining proper respect. "
@@ -198,95 +245,224 @@ def get_groq_response(message, language="English", context=None, history=None):
     # Append language instruction to the user message
     final_user_content = f"{message}\n\nRemember: {language_instruction}"
     messages.append({"role": "user", "content": final_user_content})
+    return messages
+
+def groq_model_chain():
+    """Chat models tried in order, each with its own timeout and hedge delay."""
+    return getattr(settings, 'GROQ_MODEL_CHAIN', DEFAULT_MODEL_CHAIN)
+
+def _parse_event(raw_line):
+    """
+    Reads one server-sent events line of a streamed completion. Returns
+    (finished, text chunk or None).
+    """
+    # One "data: {json}" line per chunk
+    line = raw_line.strip()
+    if not line.startswith('data:'):
+        return False, None
+    payload = line[len('data:'):].strip()
+    if payload == '[DONE]':
+        return True, None
+    choices = json.loads(payload).get('choices') or [{}]
+    return False, choices[0].get('delta', {}).get('content') or None
+
+async def _astream_content(response):
+    async for raw_line in response.aiter_lines():
+        finished, content = _parse_event(raw_line)
+        if finished:
+            return
+        if content:
+            yield content
+
+def _model_timeout(spec):
+    return httpx.Timeout(spec['timeout'], connect=min(5, spec['timeout']))
+
+async def _acomplete(data, spec):
+    started = time.monotonic()
+    async with aguarded(f"groq:chat:{spec['model']}"):
+        response = await registry.async_http('groq').post(
+            GROQ_CHAT_PATH, json=dict(data, model=spec['model']), headers=_groq_headers(),
+            timeout=_model_timeout(spec),
+        )
+        response.raise_for_status()
+    latencies.record(spec['model'], time.monotonic() - started)
+    return response.json()['choices'][0]['message']['content']
 
+async def aget_groq_response(message, language="English", context=None, history=None):
+    """
+    Sends a message to the Groq API and returns the response, hedging across
+    the model chain (see Chatbot.hedging). The attempts are asyncio tasks on
+    the pooled async client, and the loser is cancelled.
+    """
     data = {
-        "model": GROQ_MODEL,
-        "messages": messages,
+        "messages": build_groq_messages(message, language, context, history),
         "temperature": 0.7,
         "max_tokens": 1024
     }
 
-    import time
+    try:
+        return await arace(groq_model_chain(), lambda spec: _acomplete(data, spec))
+    except Exception as e:
+        return _error_message(e)
 
-    # Tier 1: Primary Model
+def _error_message(e):
+    """The user-facing reply for a chat completion that failed with ``e``."""
+    if isinstance(e, httpx.HTTPStatusError):
+        status = e.response.status_code
+        print(f"Groq API Error: {status} - {e.response.reason_phrase}")
+        if status == 429:
+            return BUSY_MESSAGE
+        if status == 503:
+             return UNAVAILABLE_MESSAGE
+        return CONNECTION_MESSAGE
+    if isinstance(e, (AttemptTimeout, httpx.TimeoutException)):
+        print(f"Groq API timeout: {e}")
+        return CONNECTION_MESSAGE
+    if isinstance(e, UpstreamUnavailable):
+        print(f"Groq API skipped: {e}")
+        return BUSY_MESSAGE
+    print(f"Error: {e}")
+    return UNEXPECTED_MESSAGE
+
+SUMMARY_MAX_TOKENS = 300
+
+def summarize_conversation(previous_summary, turns):
+    """
+    Folds ``turns`` into ``previous_summary`` using the small model, for the
+    rolling conversation summary. Returns the new summary or None on failure.
+    """
+    # Long pasted documents only need their gist here
+    transcript = "\n".join(f"{turn['role'].capitalize()}: {turn['content'][:2000]}" for turn in turns)
+    prompt = (
+        "Update the summary of this conversation between a PharmaCare user and the medical assistant. "
+        "Keep symptoms, medicines, allergies, orders and any advice already given. "
+        f"Write at most 120 words.\n\nCurrent summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"
+    )
+    data = {
+        "model": GROQ_FALLBACK_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.2,
+        "max_tokens": SUMMARY_MAX_TOKENS
+    }
     try:
-        req = urllib.request.Request(
-            GROQ_API_URL, 
-            data=json.dumps(data).encode('utf-8'), 
-            headers=headers, 
-            method='POST'
-        )
-        
-        with urllib.request.urlopen(req) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            return result['choices'][0]['message']['content']
-            
-    except urllib.error.HTTPError as e:
-        if e.code == 429:
-            print(f"Rate limit hit for {GROQ_MODEL}. Waiting 1s and switching to fallback 1 (llama-3.1-8b-instant)...")
-            time.sleep(1)
-            
-            # Tier 2: First Fallback
-            data['model'] = "llama-3.1-8b-instant"
-            try:
-                req = urllib.request.Request(
-                    GROQ_API_URL, 
-                    data=json.dumps(data).encode('utf-8'), 
-                    headers=headers, 
-                    method='POST'
-                )
-                with urllib.request.urlopen(req) as response:
-                    result = json.loads(response.read().decode('utf-8'))
-                    return result['choices'][0]['message']['content']
-            except urllib.error.HTTPError as e2:
-                print(f"Fallback 1 (Llama 8B) failed: {e2}")
-                return "I'm currently receiving too many messages and my backup is also busy. Please try again in 30 seconds."
-
-        error_body = e.read().decode('utf-8')
-        print(f"Groq API Error: {e.code} - {e.reason}")
-        print(f"Error Body: {error_body}")
-        
-        if e.code == 503:
-             return "My service is temporarily unavailable. Please try again later."
-             
-        return "I'm having trouble connecting to my brain right now. Please try again later."
+        with guarded(f"groq:chat:{GROQ_FALLBACK_MODEL}"):
+            response = registry.http('groq').post(GROQ_CHAT_PATH, json=data, headers=_groq_headers())
+            response.raise_for_status()
+        return response.json()['choices'][0]['message']['content'].strip()
     except Exception as e:
-        print(f"Error: {e}")
-        return "An unexpected error occurred. Please try again."
+        print(f"Error summarizing conversation: {e}")
+        return None
 
-def extract_text_from_image(image_bytes):
+async def _astream_model(data, spec):
+    """Streams one model's reply, recording how long its first token took."""
+    started = time.monotonic()
+    async with aguarded(f"groq:chat:{spec['model']}"), \
+            registry.async_http('groq').stream('POST', GROQ_CHAT_PATH, json=dict(data, model=spec['model']),
+                                               headers=_groq_headers(), timeout=_model_timeout(spec)) as response:
+        response.raise_for_status()
+        async for content in _astream_content(response):
+            if started is not None:
+                first_token_latencies.record(spec['model'], time.monotonic() - started)
+                started = None
+            yield content
+
+async def astream_groq_response(message, language="English", context=None, history=None):
     """
-    Extracts text from an image using Groq's vision model.
+    Streams a Groq chat completion, yielding text chunks as they arrive.
+    The model chain is hedged on time to first token: whichever model starts
+    talking first is streamed and the others are cancelled. Failures yield
+    the same user-facing messages as aget_groq_response.
     """
+    data = {
+        "messages": build_groq_messages(message, language, context, history),
+        "temperature": 0.7,
+        "max_tokens": 1024,
+        "stream": True
+    }
+    opened = []
+
+    async def first_token(spec):
+        stream = _astream_model(data, spec)
+        first = await anext(stream, '')
+        opened.append(stream)
+        return first, stream
+
+    winner = None
     try:
-        base64_image = base64.b64encode(image_bytes).decode("utf-8")
-        
-        client = groq.Groq(api_key=GROQ_API_KEY)
-
-        response = client.chat.completions.create(
-            model="meta-llama/llama-4-scout-17b-16e-instruct", # Use the requested model
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Read ALL visible text from this image. Return plain text only. If there is no text, describe the image briefly."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
+        first, winner = await arace(groq_model_chain(), first_token, tracker=first_token_latencies)
+    except Exception as e:
+        yield _error_message(e)
+        return
+    finally:
+        # Models that got their first token out just after the winner
+        for stream in opened:
+            if stream is not winner:
+                await stream.aclose()
+
+    try:
+        if first:
+            yield first
+        async for content in winner:
+            yield content
+    except Exception as e:
+        yield _error_message(e)
+    finally:
+        await winner.aclose()
+
+OCR_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+
+def _ocr_request(image_url):
+    return {
+        "model": OCR_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "Read ALL visible text from this image. Return plain text only. If there is no text, describe the image briefly."
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_url
                         }
-                    ]
-                }
-            ],
-            temperature=0,
-            max_tokens=1024
-        )
-        
-        return response.choices[0].message.content.strip()
+                    }
+                ]
+            }
+        ],
+        "temperature": 0,
+        "max_tokens": 1024
+    }
+
+OCR_ERROR_PREFIX = "[Error analyzing image"
+
+async def _aread_image_text(image_bytes, digest):
+    try:
+        image_url = await run_blocking(image_data_url, image_bytes)
+
+        async with aguarded(f"groq:vision:{OCR_MODEL}"):
+            response = await registry.async_groq().chat.completions.create(**_ocr_request(image_url))
+
+        text = response.choices[0].message.content.strip()
+        await aset_vision_result('text', digest, text)
+        return text
     except Exception as e:
         print(f"Error extracting text from image: {e}")
-        return f"[Error analyzing image: {str(e)}]"
\ No newline at end of file
+        return f"{OCR_ERROR_PREFIX}: {str(e)}]"
+
+async def aextract_text_from_image(image_bytes):
+    """
+    Extracts text from an image using Groq's vision model. The image is
+    shrunk and re-encoded first, on the chat pipeline pool; results are
+    cached by the upload's hash, and concurrent uploads of the same image
+    share one call.
+    """
+    digest = image_digest(image_bytes)
+    cached = await aget_vision_result('text', digest)
+    if cached is not None:
+        return cached
+    return await vision_flights.ado(
+        digest, lambda: _aread_image_text(image_bytes, digest),
+        share=lambda text: not text.startswith(OCR_ERROR_PREFIX),
+    )
@@ -1,9 +1,17 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
+import asyncio
 import json
-from .utils import get_groq_response, extract_text_from_image, generate_audio, transcribe_audio
+import os
+import re
+from .utils import ERROR_MESSAGES, aget_groq_response, astream_groq_response, aextract_text_from_image, aget_speech, chat_flights
+from .pipeline import StageTimings, run_blocking
+from .response_cache import make_key, response_cache
+from .tts_cache import tts_cache
 
 # Create your views here.
 def home(request):
@@ -15,143 +23,256 @@ def product_list(request):
 def product_detail(request, slug):
     return render(request, 'chatbot.html')
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def is_cacheable(text):
+    # Failed (or failed part-way) answers end with one of the error replies
+    return bool(text) and not text.endswith(tuple(ERROR_MESSAGES))
+
+def stream_chat_response(user_message, language, context_str, history, user_id, session_id, cache_key=None, cached=None):
+    """
+    Relays Groq tokens to the browser as Server-Sent Events ("token" events,
+    then one "done" event with the full text) and saves the assistant
+    message once the stream has finished, or been cut off by the client.
+    A cached answer is sent as a single token. Concurrent identical
+    cacheable questions share one upstream stream.
+    """
+    from .models import ChatMessage
+
+    async def cached_tokens():
+        yield cached
+
+    async def events():
+        chunks = []
+        try:
+            def upstream():
+                return astream_groq_response(user_message, language, context=context_str, history=history)
+
+            if cached:
+                tokens = cached_tokens()
+            elif cache_key:
+                tokens = chat_flights.astream(cache_key, upstream, share=is_cacheable)
+            else:
+                tokens = upstream()
+            async for token in tokens:
+                chunks.append(token)
+                yield sse_event('token', {'token': token})
+        finally:
+            if chunks:
+                await ChatMessage.objects.acreate(
+                    user=user_id,
+                    session_id=session_id,
+                    message=''.join(chunks),
+                    role='assistant'
+                )
+        # Only a stream that ran to completion is worth caching
+        full_text = ''.join(chunks)
+        if cache_key and not cached and is_cacheable(full_text):
+            response_cache.set(cache_key, full_text)
+        yield sse_event('done', {'response': full_text})
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let a proxy buffer the stream
+    return response
+
+async def read_attachment(uploaded_file, user_message):
+    """The context section for an uploaded file: its relevant text, or why there is none."""
+    try:
+        file_content = ""
+        file_ext = uploaded_file.name.split('.')[-1].lower()
+        
+        if file_ext in ['txt', 'pdf']:
+            # Cached, capped extraction; only the parts relevant to the question
+            from .documents import document_context
+            file_content = await run_blocking(document_context, uploaded_file, file_ext, user_message)
+        elif file_ext in ['jpg', 'jpeg', 'png']:
+            # Reset file pointer if needed, though for uploaded_file it's usually at 0
+            # uploaded_file.seek(0) 
+            file_bytes = uploaded_file.read()
+            file_content = await aextract_text_from_image(file_bytes)
+        
+        if file_content:
+            return f"\n\nUSER UPLOADED FILE CONTENT ({uploaded_file.name}):\n{file_content}\n"
+        return f"\n\nUSER UPLOADED FILE ({uploaded_file.name}) but could not extract text.\n"
+    except Exception as e:
+        return f"\n\nError reading uploaded file: {str(e)}\n"
+
+async def load_user_context(request):
+    """
+    Returns (user or None, session id or None, context text, history): who
+    is asking, their cart/orders summary and the conversation so far.
+    """
+    from .context import get_snapshot, render_context
+    from .history import build_history
+    
+    # Determine User Identifier (User ID or Session ID)
+    user_id = None
+    session_id = None
+    user = await request.auser()
+    
+    if user.is_authenticated:
+        user_id = user
+        name_to_use = user.first_name if user.first_name else user.username
+        # Cart, recent orders and recent turns come from the cached
+        # snapshot; the cart id is normally already in the session. Chatting
+        # only reads the cart, so a user without one doesn't get one created.
+        from cart.utils import CART_SESSION_KEY, find_user_cart
+        cart_id = await request.session.aget(CART_SESSION_KEY)
+        if not cart_id:
+            cart = await sync_to_async(find_user_cart)(request)
+            cart_id = cart.pk if cart else None
+        snapshot = await sync_to_async(get_snapshot)(user_id=user.pk, cart_id=cart_id)
+        context_str = render_context(name_to_use, snapshot)
+    else:
+        # Check for session key or create one
+        if not request.session.session_key:
+            await request.session.acreate()
+        session_id = request.session.session_key
+        snapshot = await sync_to_async(get_snapshot)(session_id=session_id)
+        context_str = "User is not logged in."
+
+    # Conversation history in Groq API format: rolling summary plus the
+    # newest turns within the token budget. Taken before the new message is
+    # saved; it is passed separately.
+    history = await sync_to_async(build_history)(snapshot, user.pk if user_id else None, session_id)
+    return user_id, session_id, context_str, history
+
 @csrf_exempt
 @require_POST
-def chat_api(request):
+async def chat_api(request):
+    """
+    Async so one process can hold many chats waiting on Groq at once:
+    upstream calls go through the pooled async clients and only the ORM work
+    is handed to a thread with sync_to_async.
+    """
     try:
         # Check if it's a multipart request (file upload) or JSON
         if request.content_type.startswith('multipart/form-data'):
             user_message = request.POST.get('message')
             language = request.POST.get('language', 'English')
             uploaded_file = request.FILES.get('file')
+            stream = request.POST.get('stream') in ('1', 'true')
         else:
             data = json.loads(request.body)
             user_message = data.get('message')
             language = data.get('language', 'English')
             uploaded_file = None
+            stream = bool(data.get('stream'))
+        stream = stream or 'text/event-stream' in request.headers.get('Accept', '')
         
         if not user_message and not uploaded_file:
             return JsonResponse({'error': 'Message or file is required'}, status=400)
         
-        # Build Context
-        context_str = ""
-        
-        # Handle File Upload
+        # The attachment and the user's context/history don't depend on each
+        # other, so they are built concurrently
+        timings = StageTimings()
+        stages = [timings.run('context', load_user_context(request))]
         if uploaded_file:
-            try:
-                file_content = ""
-                file_ext = uploaded_file.name.split('.')[-1].lower()
-                
-                if file_ext == 'txt':
-                    file_content = uploaded_file.read().decode('utf-8')
-                elif file_ext == 'pdf':
-                    import PyPDF2
-                    pdf_reader = PyPDF2.PdfReader(uploaded_file)
-                    for page in pdf_reader.pages:
-                        file_content += page.extract_text() + "\n"
-                elif file_ext in ['jpg', 'jpeg', 'png']:
-                    # Reset file pointer if needed, though for uploaded_file it's usually at 0
-                    # uploaded_file.seek(0) 
-                    file_bytes = uploaded_file.read()
-                    file_content = extract_text_from_image(file_bytes)
-                
-                if file_content:
-                    context_str += f"\n\nUSER UPLOADED FILE CONTENT ({uploaded_file.name}):\n{file_content}\n"
-                else:
-                     context_str += f"\n\nUSER UPLOADED FILE ({uploaded_file.name}) but could not extract text.\n"
-            except Exception as e:
-                context_str += f"\n\nError reading uploaded file: {str(e)}\n"
-
-        # Determine User Identifier (User ID or Session ID)
-        from .models import ChatMessage
-        
-        user_id = None
-        session_id = None
-        
-        if request.user.is_authenticated:
-            user_id = request.user
-            name_to_use = request.user.first_name if request.user.first_name else request.user.username
-            context_str += f"User: {name_to_use}\n"
-            
-            # Get Cart
-            from cart.models import Cart
-            carts = Cart.objects.filter(user=request.user)
-            if carts.exists():
-                cart = carts.last()
-                items = cart.items.all()
-                if items:
-                    context_str += "Current Cart:\n"
-                    for item in items:
-                        context_str += f"- {item.quantity}x {item.product.name} (${item.get_subtotal()})\n"
-                    context_str += f"Cart Total: ${cart.get_total()}\n"
-                else:
-                    context_str += "Current Cart: Empty\n"
-            
-            # Get Orders
-            # Assuming Order model has related_name='order_set' or similar (default)
-            recent_orders = request.user.order_set.all().order_by('-created_at')[:3]
-            if recent_orders:
-                context_str += "Recent Orders:\n"
-                for order in recent_orders:
-                    context_str += f"- Order #{order.id}: {order.status} (${order.total_price}) - {order.created_at.strftime('%Y-%m-%d')}\n"
-            else:
-                context_str += "Recent Orders: None\n"
-        else:
-            # Check for session key or create one
-            if not request.session.session_key:
-                request.session.create()
-            session_id = request.session.session_key
-            context_str += "User is not logged in."
+            stages.append(timings.run('file', read_attachment(uploaded_file, user_message)))
+        (user_id, session_id, user_context, history), *file_context = await asyncio.gather(*stages)
+        context_str = ''.join(file_context) + user_context
 
         # If there's no user message but there is a file, create a default message
         if not user_message and uploaded_file:
             user_message = f"I have uploaded a file named {uploaded_file.name}. Please analyze it, summarize its key points, and suggest 3 medical or health-related follow-up questions I can ask about it."
 
         # Save User Message to DB
-        ChatMessage.objects.create(
+        from .models import ChatMessage
+        await ChatMessage.objects.acreate(
             user=user_id,
             session_id=session_id,
             message=user_message,
             role='user'
         )
 
-        # Retrieve Conversation History (Last 10 messages)
-        if user_id:
-            previous_messages = ChatMessage.objects.filter(user=user_id).order_by('-created_at')[:10]
+        # Repeated questions (e.g. clicked follow-ups) are answered from the
+        # response cache. The key includes the context, so logged-in users only
+        # share answers with themselves; uploaded files skip the cache.
+        cache_key = None if uploaded_file else make_key(user_message, language, context_str, history)
+        cached = response_cache.get(cache_key) if cache_key else None
+
+        if stream:
+            timings.log()
+            response = stream_chat_response(user_message, language, context_str, history, user_id, session_id, cache_key, cached)
+            response['Server-Timing'] = timings.server_timing()
+            return response
+
+        def upstream():
+            return aget_groq_response(user_message, language, context=context_str, history=history)
+
+        if cached:
+            bot_response = cached
         else:
-            previous_messages = ChatMessage.objects.filter(session_id=session_id).order_by('-created_at')[:10]
-            
-        # Convert to Groq API format (reverse because we fetched latest first)
-        history = []
-        for msg in reversed(previous_messages):
-             # Skip the just added message to avoid duplication if we handle it differently, 
-             # but here we just fetching all. 
-             # Wait, we just inserted the user message. So it will be in `previous_messages`.
-             # We should exclude the current message from history because `get_groq_response` takes current message as separate arg.
-             if msg.message == user_message and msg.role == 'user' and msg == previous_messages[0]:
-                 continue
-             history.append({"role": msg.role, "content": msg.message})
-
-        bot_response = get_groq_response(user_message, language, context=context_str, history=history)
+            # Concurrent identical cacheable questions share one upstream call
+            completion = chat_flights.ado(cache_key, upstream, share=is_cacheable) if cache_key else upstream()
+            bot_response = await timings.run('completion', completion)
+        if cache_key and not cached and is_cacheable(bot_response):
+            response_cache.set(cache_key, bot_response)
         
         # Save Assistant Response to DB
-        ChatMessage.objects.create(
+        await ChatMessage.objects.acreate(
             user=user_id,
             session_id=session_id,
             message=bot_response,
             role='assistant'
         )
         
-        return JsonResponse({'response': bot_response})
+        timings.log()
+        response = JsonResponse({'response': bot_response})
+        response['X-Cache'] = 'HIT' if cached else 'MISS'
+        response['Server-Timing'] = timings.server_timing()
+        return response
     
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def audio_response(request, audio_file, key):
+    """
+    Serves a cached TTS clip as raw audio/wav. A single-range ``Range``
+    header gets a 206 (or 416) so players can seek and resume.
+    """
+    audio_file.seek(0, os.SEEK_END)
+    size = audio_file.tell()
+    audio_file.seek(0)
+
+    match = RANGE_RE.match(request.headers.get('Range', '').strip())
+    if match and any(match.groups()):
+        first, last = match.groups()
+        if first:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        else:  # suffix range: the last N bytes
+            start, end = max(size - int(last), 0), size - 1
+        if start > end:
+            audio_file.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        audio_file.seek(start)
+        data = audio_file.read(end - start + 1)
+        audio_file.close()
+        response = HttpResponse(data, content_type='audio/wav', status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(len(data))
+    else:
+        response = FileResponse(audio_file, content_type='audio/wav')
+        response['Content-Length'] = str(size)
+
+    # Clips are content-addressed, so a key always maps to the same bytes
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = f'"{key}"'
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    response['Content-Location'] = reverse('chatbot:tts_audio', args=[key])
+    return response
+
 @csrf_exempt
 @require_POST
-def text_to_speech_api(request):
+async def text_to_speech_api(request):
     try:
         data = json.loads(request.body)
         text = data.get('text', '')
@@ -159,10 +280,10 @@ def text_to_speech_api(request):
         if not text:
             return JsonResponse({'error': 'No text provided'}, status=400)
             
-        audio_base64 = generate_audio(text)
+        key, audio_file = await aget_speech(text)
         
-        if audio_base64:
-            return JsonResponse({'audio': audio_base64})
+        if audio_file:
+            return audio_response(request, audio_file, key)
         else:
             return JsonResponse({'error': 'Failed to generate audio'}, status=500)
             
@@ -171,22 +292,40 @@ def text_to_speech_api(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@require_GET
+def tts_audio(request, key):
+    """Replays an already synthesized clip by its cache key."""
+    audio_file = tts_cache.open(key) if re.fullmatch(r'[0-9a-f]{64}', key) else None
+    if audio_file is None:
+        raise Http404("Audio not found")
+    return audio_response(request, audio_file, key)
+
+def save_upload(uploaded_file, suffix):
+    """Copies an upload to a named temp file and returns its path."""
+    import tempfile
+
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp_file:
+        for chunk in uploaded_file.chunks():
+            temp_file.write(chunk)
+        return temp_file.name
+
 @csrf_exempt
 @require_POST
-def transcribe_api(request):
+async def transcribe_api(request):
+    """
+    Queues a voice note for transcription and returns its job id straight
+    away (202); the browser polls ``transcription_status`` for the text.
+    """
     try:
         if 'audio' not in request.FILES:
             return JsonResponse({'error': 'No audio file provided'}, status=400)
             
         audio_file = request.FILES['audio']
         
-        # Save to temporary file
-        # Used named temp file but need to close it so other process can read/open it if needed,
-        # or just correct extension for sarvam to detect type?
-        # Sarvam likely needs extension.
-        import tempfile
-        import shutil
-        import os
+        # Save to a temporary file; Sarvam needs a real file with the right
+        # extension, and the background worker deletes it when done.
+        from .jobs import submit_transcription
+        from .models import TranscriptionJob
         
         # Create a temp file with correct extension (e.g. .wav or .webm depending on frontend)
         # We will assume frontend sends blob with simple filename or we default to .webm
@@ -204,24 +343,51 @@ def transcribe_api(request):
         selected_language = request.POST.get('language', 'English')
         language_code = language_map.get(selected_language, 'unknown')
             
-        with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as temp_audio:
-            for chunk in audio_file.chunks():
-                temp_audio.write(chunk)
-            temp_audio_path = temp_audio.name
-            
-        # Transcribe
-        text = transcribe_audio(temp_audio_path, language_code=language_code)
-        
-        # Cleanup input file
-        try:
-            os.remove(temp_audio_path)
-        except:
-            pass
-            
-        if text:
-            return JsonResponse({'text': text})
-        else:
-            return JsonResponse({'error': 'Transcription failed'}, status=500)
+        temp_audio_path = await asyncio.to_thread(save_upload, audio_file, ext)
+
+        # Jobs belong to the user (or anonymous session) that submitted them
+        user = await request.auser()
+        if not user.is_authenticated and not request.session.session_key:
+            await request.session.acreate()
+
+        job = await TranscriptionJob.objects.acreate(
+            user=user if user.is_authenticated else None,
+            session_id=None if user.is_authenticated else request.session.session_key,
+            audio_path=temp_audio_path,
+            language_code=language_code,
+        )
+        await sync_to_async(submit_transcription)(job)
+
+        return JsonResponse({
+            'job_id': str(job.id),
+            'status': job.status,
+            'status_url': reverse('chatbot:transcription_status', args=[job.id]),
+        }, status=202)
             
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+@require_GET
+def transcription_status(request, job_id):
+    from .jobs import UNFINISHED, fail_stale_jobs
+    from .models import TranscriptionJob
+
+    if request.user.is_authenticated:
+        jobs = TranscriptionJob.objects.filter(user=request.user)
+    elif request.session.session_key:
+        jobs = TranscriptionJob.objects.filter(session_id=request.session.session_key)
+    else:
+        jobs = TranscriptionJob.objects.none()
+    job = jobs.filter(pk=job_id).first()
+    if job is None:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    if job.status in UNFINISHED and fail_stale_jobs(jobs.filter(pk=job.pk)):
+        # Lost with a worker that restarted; don't keep the browser polling
+        job.refresh_from_db()
+
+    data = {'job_id': str(job.id), 'status': job.status}
+    if job.status == 'done':
+        data['text'] = job.text
+    elif job.status == 'failed':
+        data['error'] = job.error or 'Transcription failed'
+    return JsonResponse(data)
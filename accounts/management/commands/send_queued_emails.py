@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.tasks import BATCH_SIZE, run_pending
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued emails in batches, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when the queue is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            claimed = run_pending(options['batch_size'])
+            if claimed:
+                self.stdout.write(f'Processed {claimed} email(s)')
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Email queue drained'))
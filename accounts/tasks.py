@@ -0,0 +1,109 @@
+"""
+Database-backed queue for outbound email.
+
+Views call ``enqueue_email`` and return straight away; the
+``send_queued_emails`` management command (or ``run_pending`` inline, e.g.
+in tests) claims due tasks in batches and sends each batch over a single
+SMTP connection. Failed sends are retried with exponential backoff until
+``EMAIL_QUEUE_MAX_ATTEMPTS`` is reached.
+
+Claiming a task pushes its ``run_at`` forward by a lease instead of using a
+separate "in progress" state, so a task held by a worker that dies simply
+becomes due again once the lease runs out.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import EmailTask
+
+BATCH_SIZE = 50
+LEASE = timedelta(minutes=5)
+
+
+def max_attempts():
+    return getattr(settings, 'EMAIL_QUEUE_MAX_ATTEMPTS', 5)
+
+
+def backoff(attempts):
+    """Delay before retry number ``attempts``: 30s, 1m, 2m, ... capped at 1h."""
+    base = getattr(settings, 'EMAIL_QUEUE_BACKOFF_SECONDS', 30)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 3600))
+
+
+def enqueue_email(subject, message, recipient_list, from_email=None):
+    return EmailTask.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(recipient_list),
+    )
+
+
+def claim_batch(limit=BATCH_SIZE):
+    """Leases up to ``limit`` due tasks to this worker and returns them."""
+    now = timezone.now()
+    with transaction.atomic():
+        # skip_locked lets several workers claim disjoint batches on Postgres
+        tasks = list(
+            EmailTask.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', run_at__lte=now)
+            .order_by('run_at')[:limit]
+        )
+        EmailTask.objects.filter(pk__in=[task.pk for task in tasks]).update(
+            run_at=now + LEASE, attempts=F('attempts') + 1,
+        )
+    for task in tasks:
+        task.attempts += 1
+    return tasks
+
+
+def _record_failure(task, error):
+    task.last_error = str(error)
+    if task.attempts >= max_attempts():
+        task.status = 'failed'
+    else:
+        task.run_at = timezone.now() + backoff(task.attempts)
+    task.save(update_fields=['status', 'run_at', 'last_error'])
+
+
+def deliver(tasks):
+    """Sends ``tasks`` over one reused connection. Returns how many were sent."""
+    if not tasks:
+        return 0
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        for task in tasks:
+            _record_failure(task, e)
+        return 0
+
+    sent = 0
+    try:
+        for task in tasks:
+            message = EmailMessage(task.subject, task.body, task.from_email, task.to, connection=connection)
+            try:
+                # One message per call so a bad address only fails its own task
+                message.send()
+            except Exception as e:
+                _record_failure(task, e)
+                continue
+            task.status, task.sent_at, task.last_error = 'sent', timezone.now(), ''
+            task.save(update_fields=['status', 'sent_at', 'last_error'])
+            sent += 1
+    finally:
+        connection.close()
+    return sent
+
+
+def run_pending(limit=BATCH_SIZE):
+    """Claims and delivers one batch. Returns the number of tasks claimed."""
+    tasks = claim_batch(limit)
+    deliver(tasks)
+    return len(tasks)
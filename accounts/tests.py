@@ -1,3 +1,91 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import EmailTask
+from .tasks import deliver, enqueue_email, run_pending
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class EmailQueueTests(TestCase):
+    def test_register_only_enqueues(self):
+        response = self.client.post('/accounts/register/', {
+            'username': 'asha',
+            'first_name': 'Asha',
+            'last_name': 'Verma',
+            'email': 'asha@example.com',
+            'password1': 'x7!kQp2#zLm9',
+            'password2': 'x7!kQp2#zLm9',
+        })
+
+        self.assertRedirects(response, '/accounts/login/', fetch_redirect_response=False)
+        self.assertEqual(len(mail.outbox), 0)
+        task = EmailTask.objects.get()
+        self.assertEqual(task.to, ['asha@example.com'])
+        self.assertIn('/accounts/activate/', task.body)
+
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Activate your PharmaCare account')
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'sent')
+        self.assertIsNotNone(task.sent_at)
+
+    def test_profile_update_only_enqueues(self):
+        user = User.objects.create_user('ravi', 'ravi@example.com', 'pw')
+        self.client.force_login(user)
+        self.client.post('/accounts/profile/', {'username': 'ravi', 'email': 'ravi@example.com', 'first_name': 'Ravi'})
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(EmailTask.objects.get().subject, 'Profile Updated')
+
+    def test_batch_shares_one_connection(self):
+        for n in range(3):
+            enqueue_email('Hello', 'Body', [f'user{n}@example.com'])
+
+        with mock.patch('accounts.tasks.get_connection', wraps=mail.get_connection) as get_connection:
+            self.assertEqual(run_pending(), 3)
+
+        get_connection.assert_called_once()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(run_pending(), 0)
+
+    def test_failures_back_off_then_give_up(self):
+        task = enqueue_email('Hello', 'Body', ['asha@example.com'])
+
+        with override_settings(EMAIL_QUEUE_MAX_ATTEMPTS=2), \
+                mock.patch('django.core.mail.EmailMessage.send', side_effect=OSError('relay down')):
+            before = timezone.now()
+            run_pending()
+            task.refresh_from_db()
+            self.assertEqual((task.status, task.attempts, task.last_error), ('pending', 1, 'relay down'))
+            self.assertGreaterEqual(task.run_at, before + timedelta(seconds=30))
+
+            self.assertEqual(run_pending(), 0)  # not due yet
+            EmailTask.objects.update(run_at=timezone.now())
+            run_pending()
+
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), ('failed', 2))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_connection_failure_retries_whole_batch(self):
+        enqueue_email('Hello', 'Body', ['asha@example.com'])
+        enqueue_email('Hello', 'Body', ['ravi@example.com'])
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open', side_effect=OSError('no route')):
+            self.assertEqual(deliver(list(EmailTask.objects.all())), 0)
+
+        self.assertEqual(EmailTask.objects.filter(status='pending', last_error='no route').count(), 2)
+
+    def test_worker_command_drains_queue(self):
+        enqueue_email('Hello', 'Body', ['asha@example.com'])
+        call_command('send_queued_emails', '--once', stdout=mock.Mock())
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(EmailTask.objects.get().status, 'sent')
@@ -3,13 +3,12 @@ from django.contrib.auth import login, authenticate, logout, get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .forms import UserRegisterForm, UserLoginForm, UserUpdateForm
-from django.core.mail import send_mail
+from .tasks import enqueue_email
 from django.template.loader import render_to_string
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
 from django.contrib.auth.tokens import default_token_generator
 from django.contrib.sites.shortcuts import get_current_site
-from django.conf import settings
 
 def register(request):
     if request.method == 'POST':
@@ -29,17 +28,13 @@ def register(request):
                 'token': default_token_generator.make_token(user),
             })
             
-            try:
-                send_mail(
-                    subject=mail_subject,
-                    message=message,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[user.email],
-                    fail_silently=False,
-                )
-                messages.success(request, 'Please check your email to confirm your registration.')
-            except Exception as e:
-                messages.error(request, f'Error sending email: {e}')
+            # Delivered by the send_queued_emails worker
+            enqueue_email(
+                subject=mail_subject,
+                message=message,
+                recipient_list=[user.email],
+            )
+            messages.success(request, 'Please check your email to confirm your registration.')
                 
             return redirect('accounts:login')
     else:
@@ -95,17 +90,12 @@ def profile(request):
             user_form.save()
             messages.success(request, 'Your profile has been updated!')
             
-            # Send Notification Email
-            try:
-                send_mail(
-                    subject='Profile Updated',
-                    message=f'Hi {request.user.username},\n\nYour profile details have been successfully updated.\n\nBest regards,\nPharmaCare Team',
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[request.user.email],
-                    fail_silently=True,
-                )
-            except Exception:
-                pass # Don't crash if email fails
+            # Queue Notification Email
+            enqueue_email(
+                subject='Profile Updated',
+                message=f'Hi {request.user.username},\n\nYour profile details have been successfully updated.\n\nBest regards,\nPharmaCare Team',
+                recipient_list=[request.user.email],
+            )
                 
             return redirect('accounts:profile')
     else:
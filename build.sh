@@ -5,3 +5,7 @@ pip install -r requirements.txt
 
 python manage.py collectstatic --noinput
 python manage.py migrate
+python manage.py createcachetable
+
+# Queued emails are sent by a separate worker process running
+# "python manage.py send_queued_emails" (see render.yaml and README.md)
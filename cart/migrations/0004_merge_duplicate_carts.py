@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:23
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    """Fold every user's extra carts into their newest one, summing quantities."""
+    Cart = apps.get_model('cart', 'Cart')
+    CartItem = apps.get_model('cart', 'CartItem')
+
+    duplicated = (
+        Cart.objects.filter(user__isnull=False)
+        .values('user').annotate(carts=Count('id')).filter(carts__gt=1)
+        .values_list('user', flat=True)
+    )
+    for user_id in duplicated:
+        carts = list(Cart.objects.filter(user_id=user_id).order_by('-id'))
+        keeper, extras = carts[0], carts[1:]
+        kept_items = {item.product_id: item for item in CartItem.objects.filter(cart=keeper)}
+
+        for item in CartItem.objects.filter(cart__in=extras).order_by('id'):
+            existing = kept_items.get(item.product_id)
+            if existing is not None:
+                existing.quantity += item.quantity
+                existing.save(update_fields=['quantity'])
+                item.delete()
+            else:
+                item.cart = keeper
+                item.save(update_fields=['cart'])
+                kept_items[item.product_id] = item
+
+        Cart.objects.filter(pk__in=[cart.pk for cart in extras]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0003_cart_user_alter_cart_session_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,38 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Window
 from django.contrib.auth.models import User
 from products.models import Product
 
-from django.db import models
+
+def line_subtotal():
+    return ExpressionWrapper(
+        F('quantity') * F('product__price'),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+class CartSummary:
+    """
+    A cart's lines and total, loaded together by ``Cart.get_summary()``.
+
+    Each item has its product preloaded and a ``subtotal`` computed in SQL.
+    """
+
+    def __init__(self, items, total):
+        self.items = items
+        self.total = total
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
 
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
@@ -10,8 +40,23 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user'], name='cart_unique_user'),
+        ]
+
     def get_total(self):
-        return sum(item.get_subtotal() for item in self.items.all())
+        return self.items.aggregate(total=Sum(line_subtotal()))['total'] or Decimal('0.00')
+
+    def get_summary(self):
+        # Lines, products, subtotals and the cart total in a single query
+        items = list(
+            self.items.select_related('product')
+            .annotate(subtotal=line_subtotal(), cart_total=Window(Sum(line_subtotal())))
+            .order_by('id')
+        )
+        total = items[0].cart_total if items else Decimal('0.00')
+        return CartSummary(items, total)
 
     def __str__(self):
         return f"Cart {self.id}"
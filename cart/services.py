@@ -0,0 +1,88 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, When
+from django.db.models.functions import Now
+
+from products import cache as catalog_cache
+from products.models import Order, OrderItem, Product
+
+from .models import Cart
+from .signals import cart_changed
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    pass
+
+
+class OutOfStock(CheckoutError):
+    def __init__(self, products):
+        self.products = products
+        names = ', '.join(product.name for product in products)
+        super().__init__(f'Not enough stock for: {names}')
+
+
+def place_order(cart, user, shipping_address):
+    """
+    Turn ``cart`` into an Order in one transaction.
+
+    The product rows are locked with one SELECT ... FOR UPDATE, stock is
+    decremented in a single guarded UPDATE, order lines are bulk inserted
+    and the cart is emptied with one DELETE. Any failure rolls the whole
+    thing back, so there are no half-written orders or oversold products.
+    """
+    with transaction.atomic():
+        quantities = {}
+        for product_id, quantity in cart.items.values_list('product_id', 'quantity'):
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        if not quantities:
+            raise EmptyCart('Cart is empty')
+
+        # Lock in primary key order so concurrent checkouts can't deadlock
+        products = {
+            product.pk: product
+            for product in Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk')
+        }
+        short = [products[pk] for pk, quantity in quantities.items() if products[pk].stock < quantity]
+        if short:
+            raise OutOfStock(short)
+
+        # The stock__gte guard keeps this safe on backends without row locks
+        in_stock = Q()
+        for pk, quantity in quantities.items():
+            in_stock |= Q(pk=pk, stock__gte=quantity)
+        savepoint = transaction.savepoint()
+        updated = Product.objects.filter(in_stock).update(
+            stock=Case(
+                *[When(pk=pk, then=F('stock') - quantity) for pk, quantity in quantities.items()],
+                output_field=IntegerField(),
+            ),
+            updated_at=Now(),
+        )
+        if updated != len(quantities):
+            # Stock moved since it was read; undo the rows that did update
+            # and re-read to name only the products that ran short
+            transaction.savepoint_rollback(savepoint)
+            stock = dict(Product.objects.filter(pk__in=quantities).values_list('pk', 'stock'))
+            short = [products[pk] for pk, quantity in quantities.items() if stock.get(pk, 0) < quantity]
+            raise OutOfStock(short or list(products.values()))
+        transaction.savepoint_commit(savepoint)
+
+        total = sum(
+            (products[pk].price * quantity for pk, quantity in quantities.items()),
+            Decimal('0.00'),
+        )
+        order = Order.objects.create(user=user, total_price=total, shipping_address=shipping_address)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=products[pk], quantity=quantity, price=products[pk].price)
+            for pk, quantity in quantities.items()
+        ])
+        cart.items.all().delete()
+        # update() sends no post_save, so the stock change needs its own bump
+        transaction.on_commit(lambda: catalog_cache.bump_version(catalog_cache.PRODUCTS))
+        transaction.on_commit(lambda: cart_changed.send(sender=Cart, cart_id=cart.pk))
+    return order
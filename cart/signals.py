@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+# Sent with ``cart_id`` after a cart's lines change (added, updated, removed
+# or checked out). Deletes are announced this way rather than through
+# post_delete, because any post_delete receiver on CartItem makes Django
+# fetch every row before bulk deletes such as the one in place_order.
+cart_changed = Signal()
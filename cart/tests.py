@@ -1,3 +1,254 @@
-from django.test import TestCase
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from products.models import Category, Order, Product
+from .models import Cart, CartItem
+from .services import EmptyCart, OutOfStock, place_order
+from .utils import CART_SESSION_KEY, find_user_cart, get_user_cart
+
+
+def make_product(stock, price='10.00'):
+    category, _ = Category.objects.get_or_create(slug='medicines', defaults={'name': 'Medicines'})
+    return Product.objects.create(
+        name=f'Paracetamol {Product.objects.count()}', slug=f'paracetamol-{Product.objects.count()}',
+        category=category, description='Fever relief', price=Decimal(price), stock=stock,
+    )
+
+
+def make_cart(username, product, quantity=1):
+    user = User.objects.create_user(username, password='pass12345')
+    cart = Cart.objects.create(user=user)
+    CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+    return user, cart
+
+
+class PlaceOrderTests(TestCase):
+    def test_places_order_and_decrements_stock(self):
+        product = make_product(stock=5, price='12.50')
+        user, cart = make_cart('asha', product, quantity=2)
+
+        order = place_order(cart, user, '12 MG Road')
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 3)
+        self.assertEqual(order.total_price, Decimal('25.00'))
+        self.assertEqual(list(order.items.values_list('product_id', 'quantity', 'price')),
+                         [(product.pk, 2, Decimal('12.50'))])
+        self.assertFalse(cart.items.exists())
+
+    def test_checkout_changes_the_product_list_etag(self):
+        product = make_product(stock=5)
+        user, cart = make_cart('meera', product, quantity=2)
+        etag = self.client.get('/api/products/', {'fields': 'id,stock'})['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(cart, user, '12 MG Road')
+
+        response = self.client.get('/api/products/', {'fields': 'id,stock'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['stock'], 3)
+
+    def test_insufficient_stock_rolls_back(self):
+        product = make_product(stock=1)
+        user, cart = make_cart('ravi', product, quantity=2)
+
+        with self.assertRaises(OutOfStock):
+            place_order(cart, user, '12 MG Road')
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 1)
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(cart.items.exists())
+
+    def test_out_of_stock_names_only_the_short_products(self):
+        plenty, scarce = make_product(stock=10), make_product(stock=1)
+        user, cart = make_cart('kiran', plenty, quantity=2)
+        CartItem.objects.create(cart=cart, product=scarce, quantity=2)
+
+        with self.assertRaises(OutOfStock) as raised:
+            place_order(cart, user, '12 MG Road')
+        self.assertEqual(raised.exception.products, [scarce])
+
+    def test_stock_sold_after_the_read_names_only_that_product(self):
+        plenty, scarce = make_product(stock=10), make_product(stock=3)
+        user, cart = make_cart('neha', plenty, quantity=2)
+        CartItem.objects.create(cart=cart, product=scarce, quantity=2)
+        # Rows as read before another checkout took scarce's stock (no row locks)
+        stale = list(Product.objects.filter(pk__in=[plenty.pk, scarce.pk]).order_by('pk'))
+        Product.objects.filter(pk=scarce.pk).update(stock=1)
+
+        with mock.patch('cart.services.Product.objects.select_for_update') as select_for_update:
+            select_for_update.return_value.filter.return_value.order_by.return_value = stale
+            with self.assertRaises(OutOfStock) as raised:
+                place_order(cart, user, '12 MG Road')
+
+        self.assertEqual(raised.exception.products, [scarce])
+        plenty.refresh_from_db()
+        self.assertEqual(plenty.stock, 10)  # its decrement was rolled back
+        self.assertFalse(Order.objects.exists())
+
+    def test_empty_cart(self):
+        user = User.objects.create_user('meera', password='pass12345')
+        with self.assertRaises(EmptyCart):
+            place_order(Cart.objects.create(user=user), user, '12 MG Road')
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def test_last_unit_cannot_be_sold_twice(self):
+        product = make_product(stock=1)
+        carts = [make_cart(name, product) for name in ('first', 'second')]
+        barrier = threading.Barrier(len(carts))
+        outcomes = []
+
+        def checkout(user, cart):
+            barrier.wait()
+            try:
+                # SQLite's shared-cache test database reports a concurrent
+                # writer as a lock error instead of waiting; try again as a
+                # user would
+                for _attempt in range(50):
+                    try:
+                        place_order(cart, user, '12 MG Road')
+                        outcomes.append('ok')
+                        return
+                    except OperationalError:
+                        time.sleep(0.01)
+            except OutOfStock as e:
+                outcomes.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=cart) for cart in carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(len(outcomes), 2)
+        self.assertEqual(outcomes.count('ok'), 1)
+        refused = next(outcome for outcome in outcomes if outcome != 'ok')
+        self.assertIsInstance(refused, OutOfStock)
+        self.assertEqual([p.pk for p in refused.products], [product.pk])
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(CartItem.objects.count(), 1)  # the refused cart keeps its item
+
+
+class UserCartTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('asha', password='pass12345')
+        self.request = RequestFactory().get('/cart/')
+        self.request.user = self.user
+        self.request.session = {}
+
+    def test_created_once_and_remembered(self):
+        cart = get_user_cart(self.request)
+        self.assertEqual(self.request.session[CART_SESSION_KEY], cart.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_user_cart(self.request), cart)
+
+    def test_stale_session_cart_id_is_replaced(self):
+        cart = Cart.objects.create(user=self.user)
+        other = Cart.objects.create(user=User.objects.create_user('ravi', password='pass12345'))
+
+        for stale_id in (cart.pk + other.pk + 100, other.pk):  # deleted, then someone else's
+            with self.subTest(stale_id=stale_id):
+                self.request.session[CART_SESSION_KEY] = stale_id
+                self.assertEqual(get_user_cart(self.request), cart)
+                self.assertEqual(self.request.session[CART_SESSION_KEY], cart.pk)
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 1)
+
+    def test_find_never_creates(self):
+        self.assertIsNone(find_user_cart(self.request))
+        self.assertFalse(Cart.objects.exists())
+        self.assertNotIn(CART_SESSION_KEY, self.request.session)
+
+
+class CartSummaryTests(TestCase):
+    def setUp(self):
+        self.user, self.cart = make_cart('asha', make_product(stock=100, price='12.50'), quantity=3)
+        self.client.force_login(self.user)
+
+    def add_items(self, count):
+        for n in range(count):
+            CartItem.objects.create(cart=self.cart, product=make_product(stock=100, price=f'{n}.25'), quantity=n + 1)
+
+    def test_summary_matches_the_python_sums(self):
+        self.add_items(49)
+        summary = self.cart.get_summary()
+
+        items = list(self.cart.items.order_by('id'))
+        self.assertEqual(len(summary), 50)
+        self.assertEqual([item.subtotal for item in summary], [item.get_subtotal() for item in items])
+        self.assertEqual(summary.total, sum(item.get_subtotal() for item in items))
+        self.assertEqual(summary.total, self.cart.get_total())
+
+    def test_empty_cart(self):
+        self.cart.items.all().delete()
+        summary = self.cart.get_summary()
+        self.assertFalse(summary)
+        self.assertEqual(summary.total, Decimal('0.00'))
+
+    def test_cart_detail_queries_do_not_grow_with_the_cart(self):
+        self.client.get('/cart/')  # the first visit remembers the cart in the session
+        with CaptureQueriesContext(connection) as one_item:
+            self.client.get('/cart/')
+
+        self.add_items(49)
+        with self.assertNumQueries(len(one_item)):
+            response = self.client.get('/cart/')
+        self.assertEqual(len(response.context['summary']), 50)
+        self.assertContains(response, f'₹{self.cart.get_total():.2f}')
+
+
+class MergeDuplicateCartsMigrationTests(TransactionTestCase):
+    before = [('cart', '0003_cart_user_alter_cart_session_key')]
+    after = [('cart', '0004_merge_duplicate_carts')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicate_carts_are_folded_into_the_newest(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        Cart = apps.get_model('cart', 'Cart')
+        CartItem = apps.get_model('cart', 'CartItem')
+        category = apps.get_model('products', 'Category').objects.create(name='Fever', slug='fever')
+        Product = apps.get_model('products', 'Product')
+        dolo, crocin = (
+            Product.objects.create(category=category, name=name, slug=name, description='', price=10, stock=5)
+            for name in ('dolo', 'crocin')
+        )
+        asha = apps.get_model('auth', 'User').objects.create(username='asha')
+        ravi = apps.get_model('auth', 'User').objects.create(username='ravi')
+
+        older, newer = Cart.objects.create(user=asha), Cart.objects.create(user=asha)
+        CartItem.objects.create(cart=older, product=dolo, quantity=1)
+        CartItem.objects.create(cart=older, product=crocin, quantity=3)
+        CartItem.objects.create(cart=newer, product=dolo, quantity=2)
+        single = Cart.objects.create(user=ravi)
+        CartItem.objects.create(cart=single, product=dolo, quantity=1)
+        anonymous = Cart.objects.create(session_key='abc')
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+
+        self.assertEqual(
+            sorted(Cart.objects.values_list('pk', flat=True)), sorted([newer.pk, single.pk, anonymous.pk]),
+        )
+        self.assertEqual(
+            sorted(CartItem.objects.filter(cart=newer).values_list('product_id', 'quantity')),
+            sorted([(dolo.pk, 3), (crocin.pk, 3)]),
+        )
+        self.assertEqual(list(CartItem.objects.filter(cart=single).values_list('quantity', flat=True)), [1])
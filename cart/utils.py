@@ -0,0 +1,33 @@
+from .models import Cart
+
+CART_SESSION_KEY = 'cart_id'
+
+
+def find_user_cart(request):
+    """
+    Return the logged-in user's cart, or None if they have none yet.
+
+    Read-only counterpart of ``get_user_cart`` for pages that only show the
+    cart. The cart id is remembered in the session, so the usual cost is a
+    single primary key lookup (still scoped to the user, in case the session
+    outlived the cart); a miss falls back to the unique user lookup.
+    """
+    cart_id = request.session.get(CART_SESSION_KEY)
+    if cart_id is not None:
+        cart = Cart.objects.filter(pk=cart_id, user=request.user).first()
+        if cart is not None:
+            return cart
+
+    cart = Cart.objects.filter(user=request.user).first()
+    if cart is not None:
+        request.session[CART_SESSION_KEY] = cart.pk
+    return cart
+
+
+def get_user_cart(request):
+    """Return the logged-in user's cart, creating it on first use."""
+    cart = find_user_cart(request)
+    if cart is None:
+        cart, created = Cart.objects.get_or_create(user=request.user)
+        request.session[CART_SESSION_KEY] = cart.pk
+    return cart
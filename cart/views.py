@@ -2,38 +2,27 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .models import Cart, CartItem
-from products.models import Product, Order, OrderItem
+from .services import CheckoutError, place_order
+from .signals import cart_changed
+from .utils import get_user_cart
+from products.models import Product
 
 @login_required
 def cart_detail(request):
-    # Ensure only one cart exists
-    carts = Cart.objects.filter(user=request.user)
-    if carts.exists():
-        cart = carts.last()
-        if carts.count() > 1:
-            # Delete older duplicates if they exist
-            carts.exclude(id=cart.id).delete()
-    else:
-        cart = Cart.objects.create(user=request.user)
-    
-    return render(request, 'cart/cart_detail.html', {'cart': cart})
+    cart = get_user_cart(request)
+    return render(request, 'cart/cart_detail.html', {'cart': cart, 'summary': cart.get_summary()})
 
 @login_required
 def add_to_cart(request, product_id):
     product = get_object_or_404(Product, id=product_id)
     
-    # robust cart retrieval
-    carts = Cart.objects.filter(user=request.user)
-    if carts.exists():
-        cart = carts.last()
-    else:
-        cart = Cart.objects.create(user=request.user)
-
+    cart = get_user_cart(request)
     cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product)
     
     if not created:
         cart_item.quantity += 1
         cart_item.save()
+    cart_changed.send(sender=Cart, cart_id=cart.pk)
     
     messages.success(request, f'{product.name} added to cart!')
     return redirect('cart:cart_detail')
@@ -42,6 +31,7 @@ def add_to_cart(request, product_id):
 def remove_from_cart(request, item_id):
     cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
     cart_item.delete()
+    cart_changed.send(sender=Cart, cart_id=cart_item.cart_id)
     messages.success(request, 'Item removed from cart!')
     return redirect('cart:cart_detail')
 
@@ -56,35 +46,27 @@ def update_cart(request, item_id):
             cart_item.save()
         else:
             cart_item.delete()
+        cart_changed.send(sender=Cart, cart_id=cart_item.cart_id)
     
     return redirect('cart:cart_detail')
 
 @login_required
 def checkout(request):
-    cart = get_object_or_404(Cart, user=request.user)
+    cart = get_user_cart(request)
     
     if request.method == 'POST':
         shipping_address = request.POST.get('shipping_address')
         
-        order = Order.objects.create(
-            user=request.user,
-            total_price=cart.get_total(),
-            shipping_address=shipping_address
-        )
-        
-        for item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                price=item.product.price
-            )
-        
-        cart.items.all().delete()
+        try:
+            place_order(cart, request.user, shipping_address)
+        except CheckoutError as e:
+            messages.error(request, str(e))
+            return redirect('cart:cart_detail')
+
         messages.success(request, 'Order placed successfully!')
         return redirect('products:home')
     
-    return render(request, 'cart/checkout.html', {'cart': cart})
+    return render(request, 'cart/checkout.html', {'cart': cart, 'summary': cart.get_summary()})
 
 
 
@@ -117,6 +99,6 @@ class CartViewSet(viewsets.ModelViewSet):
         cart = self.get_object()
         return Response({
             "cart_id": cart.id,
-            "total": cart.get_total(),
+            "total": cart.get_summary().total,
             "created_at": cart.created_at,
         })
\ No newline at end of file
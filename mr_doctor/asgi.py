@@ -3,6 +3,16 @@ ASGI config for mr_doctor project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+This is what the deploy serves (see render.yaml):
+
+    gunicorn mr_doctor.asgi:application -k uvicorn.workers.UvicornWorker
+
+The chatbot API views are async. Under WSGI each request would run on its
+own event loop and hold a worker for its whole upstream call, and the
+streamed chat replies (server-sent events from an async generator) would be
+buffered whole before being sent, so the browser gets no tokens until the
+answer is complete. wsgi.py is kept only for tools that expect it.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
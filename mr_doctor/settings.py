@@ -79,12 +79,14 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'products.context_processors.categories',
             ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'mr_doctor.wsgi.application'
+ASGI_APPLICATION = 'mr_doctor.asgi.application'
 
 
 
@@ -105,6 +107,28 @@ DATABASES = {
 }
 
 
+# Cache shared by every worker process. Version tokens (products/cache.py),
+# cached catalog selections and the chat context snapshot are invalidated
+# by deleting or bumping entries here, which only reaches the other workers
+# if they all read the same cache: Redis when REDIS_URL is set (needs the
+# redis package), otherwise the database cache table created by build.sh.
+# Local development without DATABASE_URL runs one process, so memory is fine.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+elif os.getenv('DATABASE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        }
+    }
+
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
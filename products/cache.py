@@ -0,0 +1,30 @@
+"""
+Cross-process version tokens for catalog caches.
+
+Signals bump a token in the shared cache whenever the underlying rows change;
+anything derived from those rows (in-process indexes, cached querysets) keeps
+the token it was built from and rebuilds when it no longer matches.
+"""
+import uuid
+
+from django.core.cache import cache
+
+PRODUCTS = 'products'
+CATEGORIES = 'categories'
+
+
+def _key(name):
+    return f'products:version:{name}'
+
+
+def get_version(name):
+    version = cache.get(_key(name))
+    if version is None:
+        # Evicted or never set: a fresh token forces every consumer to rebuild
+        cache.add(_key(name), uuid.uuid4().hex, None)
+        version = cache.get(_key(name))
+    return version
+
+
+def bump_version(name):
+    cache.set(_key(name), uuid.uuid4().hex, None)
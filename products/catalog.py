@@ -0,0 +1,54 @@
+"""
+Cached catalog selections shared by the storefront views.
+
+Entries are keyed on the version tokens from ``products/cache.py``, so a
+Product or Category save/delete anywhere makes every worker recompute on
+its next request; steady-state renders only touch the cache.
+"""
+from django.core.cache import cache
+from django.db.models import Case, F, IntegerField, Value, When, Window
+from django.db.models.functions import RowNumber
+
+from . import cache as catalog_cache
+from .models import Category, Product
+
+FEATURED_COUNT = 6
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_categories():
+    """All categories by name; the registry behind nav menus and filters."""
+    key = 'products:categories:{}'.format(catalog_cache.get_version(catalog_cache.CATEGORIES))
+    categories = cache.get(key)
+    if categories is None:
+        categories = list(Category.objects.order_by('name'))
+        cache.set(key, categories, CACHE_TIMEOUT)
+    return categories
+
+
+def _select_featured_products():
+    # Newest product of each category first, then the newest of the rest
+    ranked = Product.objects.filter(active=True).annotate(
+        category_rank=Window(
+            RowNumber(),
+            partition_by=F('category_id'),
+            order_by=[F('created_at').desc(), F('id').desc()],
+        ),
+    )
+    return list(ranked.order_by(
+        Case(When(category_rank=1, then=Value(0)), default=Value(1), output_field=IntegerField()),
+        '-created_at',
+        '-id',
+    )[:FEATURED_COUNT])
+
+
+def get_featured_products():
+    key = 'products:featured:{}:{}'.format(
+        catalog_cache.get_version(catalog_cache.PRODUCTS),
+        catalog_cache.get_version(catalog_cache.CATEGORIES),
+    )
+    featured = cache.get(key)
+    if featured is None:
+        featured = _select_featured_products()
+        cache.set(key, featured, CACHE_TIMEOUT)
+    return featured
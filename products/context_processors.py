@@ -0,0 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+
+from .catalog import get_categories
+
+
+def categories(request):
+    """Expose the cached category registry as ``categories`` in every template."""
+    return {'categories': SimpleLazyObject(get_categories)}
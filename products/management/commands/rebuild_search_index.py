@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from products.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product full-text search index from the Product table'
+
+    def handle(self, *args, **kwargs):
+        get_search_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
@@ -0,0 +1,120 @@
+"""
+Fuzzy matching of prescription medicine names against the catalog.
+
+A character-trigram index over active product names is built once per
+process and rebuilt when the products version token changes (see
+``products/cache.py``), so a whole prescription is matched in memory with a
+single query to load the winning products.
+"""
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from . import cache as catalog_cache
+from .models import Product
+
+MATCH_THRESHOLD = getattr(settings, 'RX_MATCH_THRESHOLD', 0.5)
+MATCHES_PER_NAME = getattr(settings, 'RX_MATCHES_PER_NAME', 10)
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def normalize(name):
+    return ' '.join(WORD_RE.findall(name.lower()))
+
+
+def trigrams(text):
+    """pg_trgm style trigrams: each word padded with two leading and one trailing space."""
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+class MedicineNameIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        # (names, sizes, postings) swapped as one tuple so readers never see a mix
+        self._state = ({}, {}, {})
+
+    def _refresh(self):
+        version = catalog_cache.get_version(catalog_cache.PRODUCTS)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            names, sizes, postings = {}, {}, defaultdict(set)
+            for pk, name in Product.objects.filter(active=True).values_list('pk', 'name'):
+                normalized = normalize(name)
+                grams = trigrams(normalized)
+                names[pk] = normalized
+                sizes[pk] = len(grams)
+                for gram in grams:
+                    postings[gram].add(pk)
+            self._state = (names, sizes, dict(postings))
+            self._version = version
+
+    def match(self, queries, threshold=MATCH_THRESHOLD, limit=MATCHES_PER_NAME):
+        """
+        Score every query against the index in one pass.
+
+        The score is the share of the query's trigrams found in the product
+        name (1.0 when the query is a substring, like the old icontains match).
+        Returns {product_id: (score, query)} with each product's best score.
+        """
+        self._refresh()
+        names, sizes, postings = self._state
+        best = {}
+        for query in queries:
+            normalized = normalize(query)
+            grams = trigrams(normalized)
+            if not grams:
+                continue
+
+            hits = Counter()
+            for gram in grams:
+                hits.update(postings.get(gram, ()))
+
+            scored = []
+            for pk, shared in hits.items():
+                score = 1.0 if normalized in names[pk] else shared / len(grams)
+                if score >= threshold:
+                    # Jaccard breaks ties in favour of names without extra words
+                    jaccard = shared / (len(grams) + sizes[pk] - shared)
+                    scored.append((score, jaccard, pk))
+            scored.sort(key=lambda s: (-s[0], -s[1], s[2]))
+
+            for score, jaccard, pk in scored[:limit]:
+                if pk not in best or score > best[pk][0]:
+                    best[pk] = (score, query)
+        return best
+
+
+medicine_index = MedicineNameIndex()
+
+
+def match_medicines(names):
+    """
+    Return active products matching any of ``names``, best match first.
+
+    Each product carries ``match_score`` (0-1) and ``matched_medicine``.
+    """
+    best = medicine_index.match(names)
+    if not best:
+        return []
+    products = Product.objects.filter(active=True).in_bulk(list(best))
+    matched = []
+    for pk, (score, query) in best.items():
+        product = products.get(pk)
+        if product is not None:
+            product.match_score = score
+            product.matched_medicine = query
+            matched.append(product)
+    matched.sort(key=lambda p: (-p.match_score, p.name))
+    return matched
@@ -0,0 +1,55 @@
+from django.db import migrations
+
+
+POSTGRES_FORWARD = [
+    """
+    CREATE TABLE products_product_search (
+        product_id bigint PRIMARY KEY REFERENCES products_product (id) ON DELETE CASCADE,
+        document tsvector NOT NULL
+    )
+    """,
+    "CREATE INDEX products_product_search_document_gin ON products_product_search USING GIN (document)",
+    """
+    INSERT INTO products_product_search (product_id, document)
+    SELECT id,
+           setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+    FROM products_product
+    """,
+]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE products_product_fts USING fts5(
+        name, description, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    "INSERT INTO products_product_fts (rowid, name, description) SELECT id, name, description FROM products_product",
+]
+
+BACKWARD = {
+    'postgresql': ["DROP TABLE IF EXISTS products_product_search"],
+    'sqlite': ["DROP TABLE IF EXISTS products_product_fts"],
+}
+
+
+def create_search_index(apps, schema_editor):
+    forward = {'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}
+    for sql in forward.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    for sql in BACKWARD.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_image_url'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['active', '-created_at', '-id'], name='product_active_recent_idx'),
+        ),
+    ]
@@ -25,6 +25,12 @@ class Product(models.Model):
     active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the product list walks (created_at, id) newest first
+            models.Index(fields=['active', '-created_at', '-id'], name='product_active_recent_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -55,4 +61,25 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     
     def __str__(self):
-        return f"{self.quantity} x {self.product.name}"
\ No newline at end of file
+        return f"{self.quantity} x {self.product.name}"
+
+
+class Prescription(models.Model):
+    """
+    What the vision model read off an uploaded prescription, kept so it can
+    be re-opened and re-matched against the catalog without another upload.
+    Belongs to a user, or to an anonymous session.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    session_key = models.CharField(max_length=40, null=True, blank=True, db_index=True)
+    image_hash = models.CharField(max_length=64, db_index=True)  # SHA-256 of the uploaded file
+    medicines = models.JSONField(default=list)
+    matched_product_ids = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # last time the matches changed
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Prescription {self.id} ({len(self.medicines)} medicines)"
@@ -0,0 +1,121 @@
+"""
+Keyset (cursor) pagination for the storefront product list.
+
+Pages are addressed by an opaque ``cursor`` that encodes the sort key of the
+last product shown, so every page is one indexed range scan with no COUNT or
+OFFSET. Browsing pages are keyed on (created_at, id). Search results are
+an in-memory list of at most ``SEARCH_MAX_RESULTS`` hits whose tie order
+depends on the backend, so their cursor is the position in that list plus
+the id of the product shown there.
+"""
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.pagination import CursorPagination
+
+from .search import SearchResults
+
+MAX_PK = 2 ** 63 - 1  # larger ids overflow the database's integer column
+
+
+def encode_cursor(key):
+    raw = json.dumps(key, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the decoded key, or None for a missing or tampered cursor."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(key, list) or len(key) != 2:
+        return None
+    pk = key[1]
+    if not isinstance(pk, int) or isinstance(pk, bool) or not 0 < pk <= MAX_PK:
+        return None
+    return key
+
+
+class CursorPage:
+    """One page of products; mirrors the bits of Page the templates use."""
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+class KeysetPaginator:
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = per_page
+
+    def get_page(self, cursor):
+        key = decode_cursor(cursor)
+        if isinstance(self.object_list, SearchResults):
+            return self._search_page(key)
+        return self._queryset_page(key)
+
+    def _queryset_page(self, key):
+        queryset = self.object_list.order_by('-created_at', '-id')
+        if key is not None:
+            try:
+                created_at = parse_datetime(str(key[0]))
+            except ValueError:  # well formed but not a real date
+                created_at = None
+            pk = key[1]
+            if created_at is not None:
+                # created_at <= x keeps the predicate an index range scan
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk),
+                    created_at__lte=created_at,
+                )
+        products = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(products) > self.per_page:
+            products = products[:self.per_page]
+            last = products[-1]
+            next_cursor = encode_cursor([last.created_at.isoformat(), last.pk])
+        return CursorPage(products, next_cursor)
+
+    def _search_page(self, key):
+        hits = self.object_list.hits
+        start = 0
+        if key is not None:
+            position, pk = key
+            if isinstance(position, int) and not isinstance(position, bool) and 0 < position <= len(hits):
+                start = position
+                if hits[position - 1][0] != pk:
+                    # The hits moved since the last page; continue after that product
+                    pks = [hit_pk for hit_pk, _rank in hits]
+                    start = pks.index(pk) + 1 if pk in pks else position
+        end = start + self.per_page
+        products = self.object_list[start:end]
+        next_cursor = None
+        if end < len(hits):
+            next_cursor = encode_cursor([end, hits[end - 1][0]])
+        return CursorPage(products, next_cursor)
+
+
+class ProductCursorPagination(CursorPagination):
+    """DRF counterpart for the products API, same (created_at, id) keyset."""
+
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,180 @@
+"""
+Reading medicine names off prescription photos with the Llama 4 vision models,
+and the stored ``Prescription`` records that let customers re-open them.
+"""
+import json
+import logging
+
+import groq
+
+from Chatbot.clients import registry
+from Chatbot.guards import UpstreamUnavailable, guarded
+from Chatbot.images import get_vision_result, image_data_url, image_digest, set_vision_result
+
+from .matching import match_medicines
+from .models import Prescription
+
+SCOUT_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+MAVERICK_MODEL = "meta-llama/llama-4-maverick-17b-128e-instruct"
+
+RX_PROMPT = """Analyze this prescription image and extract ONLY actual pharmaceutical medicine/drug names.
+
+IMPORTANT RULES:
+- Return ONLY a valid JSON list of strings (e.g. ["Medicine A", "Medicine B"])
+- ONLY include actual medicine names (like "Paracetamol", "Amoxicillin", "Metformin")
+- IGNORE any non-medicine text like:
+  * Instructions (e.g., "Take twice daily", "After meals")
+  * Patient information (e.g., "John Doe", "Age 45")
+  * Doctor information (e.g., "Dr. Smith", "License #123")
+  * Dates, addresses, or clinic names
+  * Non-medical terms like "Backtesting", "Paper Trading", etc.
+- If no actual medicine names are found, return an empty list []
+
+Do not include any other text or markdown formatting."""
+
+# Terms the model sometimes returns that are never medicine names
+COMMON_NON_MEDICAL = ['backtesting', 'paper trading', 'trading alerts', 'algorithmic trading',
+                      'buy', 'sell', 'signal', 'indicator', 'strategy', 'test', 'demo']
+
+
+def parse_medicines(response_content):
+    """Turns the model's reply into a filtered list of medicine names."""
+    # Clean up potential markdown code blocks
+    if response_content.startswith('```json'):
+        response_content = response_content.replace('```json', '').replace('```', '')
+    elif response_content.startswith('```'):
+        response_content = response_content.replace('```', '')
+
+    try:
+        detected_medicines = json.loads(response_content)
+        if not isinstance(detected_medicines, list):
+             if isinstance(detected_medicines, dict):
+                for key, value in detected_medicines.items():
+                    if isinstance(value, list):
+                        detected_medicines = value
+                        break
+             else:
+                detected_medicines = []
+    except json.JSONDecodeError:
+        detected_medicines = []
+        logging.error(f"Failed to parse Groq response: {response_content}")
+
+    # Additional filtering: Only keep items that might be medicine names
+    # This helps filter out obvious non-medicine terms
+    filtered_medicines = []
+    for med in detected_medicines:
+        if not isinstance(med, str):
+            continue
+        med_lower = med.lower()
+        # Skip if it contains common non-medical terms
+        if any(term in med_lower for term in COMMON_NON_MEDICAL):
+            continue
+        # Skip very short terms (likely not medicine names)
+        if len(med) < 3:
+            continue
+        filtered_medicines.append(med)
+    return filtered_medicines
+
+
+def detect_medicines(image_bytes):
+    """
+    Medicine names found on a prescription photo. The photo is shrunk and
+    re-encoded before upload, and results are cached by its hash, so the same
+    prescription is only ever analyzed once.
+    """
+    digest = image_digest(image_bytes)
+    cached = get_vision_result('rx', digest)
+    if cached is not None:
+        return cached
+
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": RX_PROMPT},
+                {"type": "image_url", "image_url": {"url": image_data_url(image_bytes)}},
+            ],
+        }
+    ]
+
+    client = registry.groq()
+    try:
+        # Use Llama 4 Scout which is multimodal
+        with guarded(f"groq:vision:{SCOUT_MODEL}"):
+            chat_completion = client.chat.completions.create(
+                messages=messages,
+                model=SCOUT_MODEL,
+                temperature=0.1
+            )
+    except (groq.BadRequestError, UpstreamUnavailable) as e:
+        # Fallback to Maverick if Scout fails or its circuit is open
+        logging.warning(f"Llama 4 Scout failed, trying Maverick: {e}")
+        with guarded(f"groq:vision:{MAVERICK_MODEL}"):
+            chat_completion = client.chat.completions.create(
+                messages=messages,
+                model=MAVERICK_MODEL,
+            )
+
+    medicines = parse_medicines(chat_completion.choices[0].message.content.strip())
+    set_vision_result('rx', digest, medicines)
+    return medicines
+
+
+# The anonymous session a visitor's prescriptions were stored under. Login
+# gives the session a new key but keeps its data, so this survives it.
+RX_SESSION_KEY = 'prescription_session_key'
+
+
+def owned_prescriptions(request):
+    """Prescriptions belonging to the current user, or anonymous session."""
+    if request.user.is_authenticated:
+        return Prescription.objects.filter(user=request.user)
+    if request.session.session_key:
+        return Prescription.objects.filter(user=None, session_key=request.session.session_key)
+    return Prescription.objects.none()
+
+
+def record_prescription(request, image_bytes):
+    """
+    Returns the Prescription for an uploaded photo. A re-upload of a photo
+    the customer (or anyone) already sent reuses its stored medicine list
+    instead of calling the vision model again.
+    """
+    digest = image_digest(image_bytes)
+    existing = owned_prescriptions(request).filter(image_hash=digest).first()
+    if existing is not None:
+        return existing
+
+    known = Prescription.objects.filter(image_hash=digest).values_list('medicines', flat=True).first()
+    medicines = known if known is not None else detect_medicines(image_bytes)
+
+    if not request.user.is_authenticated:
+        if not request.session.session_key:
+            request.session.create()
+        request.session[RX_SESSION_KEY] = request.session.session_key
+    return Prescription.objects.create(
+        user=request.user if request.user.is_authenticated else None,
+        session_key=None if request.user.is_authenticated else request.session.session_key,
+        image_hash=digest,
+        medicines=medicines,
+    )
+
+
+def rematch(prescription):
+    """
+    Matches the stored medicines against the current catalog; no upstream
+    call, and the row is only written when the matches changed.
+    """
+    matched_products = match_medicines(prescription.medicines)
+    matched_ids = [product.pk for product in matched_products]
+    if matched_ids != prescription.matched_product_ids:
+        prescription.matched_product_ids = matched_ids
+        prescription.save(update_fields=['matched_product_ids', 'updated_at'])
+    return matched_products
+
+
+def claim_session_prescriptions(request, user):
+    """Hands the prescriptions uploaded before logging in to ``user``."""
+    session_key = request.session.pop(RX_SESSION_KEY, None)
+    if session_key:
+        Prescription.objects.filter(user=None, session_key=session_key).update(user=user, session_key=None)
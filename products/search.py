@@ -0,0 +1,189 @@
+"""
+Full-text search over the product catalog.
+
+Postgres keeps a weighted tsvector per product in ``products_product_search``
+(GIN indexed), SQLite keeps an FTS5 table ``products_product_fts``. Both are
+kept current by the Product signals in ``products/signals.py``; anything that
+bypasses signals (bulk_create, queryset.update) needs
+``manage.py rebuild_search_index``. Other databases fall back to icontains.
+"""
+import re
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+# Upper bound on ranked hits pulled per search. Nobody scrolls past this.
+SEARCH_MAX_RESULTS = getattr(settings, 'PRODUCT_SEARCH_MAX_RESULTS', 1000)
+SEARCH_MAX_TERMS = 10
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(query):
+    """Split a raw search box value into lowercase terms safe for MATCH / to_tsquery."""
+    return TOKEN_RE.findall(query.lower())[:SEARCH_MAX_TERMS]
+
+
+class SearchResults:
+    """
+    Rank-ordered search hits that only load the products actually displayed.
+
+    Supports len() and slicing, so it can be handed straight to Paginator
+    (no COUNT query) and iterated by the existing templates. Each product
+    gets a ``search_rank`` attribute, higher is better.
+    """
+
+    def __init__(self, queryset, hits):
+        self.queryset = queryset
+        self.hits = hits  # [(pk, rank), ...] best first
+
+    def __len__(self):
+        return len(self.hits)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            results = self[index:index + 1] if index >= 0 else self[index:][:1]
+            if not results:
+                raise IndexError('search result index out of range')
+            return results[0]
+
+        hits = self.hits[index]
+        products = self.queryset.in_bulk([pk for pk, rank in hits])
+        results = []
+        for pk, rank in hits:
+            product = products.get(pk)
+            if product is not None:
+                product.search_rank = rank
+                results.append(product)
+        return results
+
+
+class BaseSearchBackend(ABC):
+    def search(self, queryset, query, limit=SEARCH_MAX_RESULTS):
+        """Restrict ``queryset`` to products matching ``query``, best match first."""
+        terms = tokenize(query)
+        if not terms:
+            return SearchResults(queryset, [])
+        return SearchResults(queryset, self.ranked_hits(queryset, terms, limit))
+
+    @abstractmethod
+    def ranked_hits(self, queryset, terms, limit):
+        """[(pk, rank), ...] for products in ``queryset`` matching all ``terms``, best first."""
+
+    def index_product(self, product):
+        pass
+
+    def remove_product(self, product_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def _subquery(self, queryset):
+        return queryset.order_by().values('pk').query.sql_with_params()
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """tsvector documents (name weighted A, description B) behind a GIN index."""
+
+    config = 'simple'
+    document_sql = (
+        "setweight(to_tsvector('simple', coalesce(%s, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(%s, '')), 'B')"
+    )
+
+    def ranked_hits(self, queryset, terms, limit):
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        subquery, params = self._subquery(queryset)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT s.product_id, ts_rank(s.document, q.query) AS rank "
+                "FROM products_product_search s, to_tsquery(%s, %s) AS q(query) "
+                f"WHERE s.document @@ q.query AND s.product_id IN ({subquery}) "
+                "ORDER BY rank DESC, s.product_id LIMIT %s",
+                [self.config, tsquery, *params, limit],
+            )
+            return cursor.fetchall()
+
+    def index_product(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO products_product_search (product_id, document) "
+                f"VALUES (%s, {self.document_sql}) "
+                "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                [product.pk, product.name, product.description],
+            )
+
+    def remove_product(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM products_product_search WHERE product_id = %s", [product_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM products_product_search")
+            cursor.execute(
+                "INSERT INTO products_product_search (product_id, document) "
+                "SELECT id, " + self.document_sql % ('name', 'description') + " FROM products_product"
+            )
+
+
+class SqliteSearchBackend(BaseSearchBackend):
+    """FTS5 table keyed by product id, ranked with bm25 (name weighted 10x)."""
+
+    def ranked_hits(self, queryset, terms, limit):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        subquery, params = self._subquery(queryset)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT rowid, -bm25(products_product_fts, 10.0, 1.0) AS rank "
+                "FROM products_product_fts "
+                f"WHERE products_product_fts MATCH %s AND rowid IN ({subquery}) "
+                "ORDER BY rank DESC, rowid LIMIT %s",
+                [match, *params, limit],
+            )
+            return cursor.fetchall()
+
+    def index_product(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM products_product_fts WHERE rowid = %s", [product.pk])
+            cursor.execute(
+                "INSERT INTO products_product_fts (rowid, name, description) VALUES (%s, %s, %s)",
+                [product.pk, product.name, product.description],
+            )
+
+    def remove_product(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM products_product_fts WHERE rowid = %s", [product_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM products_product_fts")
+            cursor.execute(
+                "INSERT INTO products_product_fts (rowid, name, description) "
+                "SELECT id, name, description FROM products_product"
+            )
+
+
+class IContainsSearchBackend(BaseSearchBackend):
+    """Unindexed fallback for databases without a native full-text engine."""
+
+    def ranked_hits(self, queryset, terms, limit):
+        for term in terms:
+            queryset = queryset.filter(Q(name__icontains=term) | Q(description__icontains=term))
+        pks = queryset.order_by('-created_at', '-id').values_list('pk', flat=True)[:limit]
+        return [(pk, 0.0) for pk in pks]
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+def get_search_backend():
+    return BACKENDS.get(connection.vendor, IContainsSearchBackend)()
@@ -2,6 +2,30 @@ from rest_framework import serializers
 from .models import Product
 
 class ProductSerializer(serializers.ModelSerializer):
+    """
+    Product representation for the REST API.
+
+    Responses carry ``id``, ``name`` and ``price`` unless the client asks for
+    other fields with ``?fields=id,name,stock,category``; unknown names are
+    ignored and a selection with no known field falls back to the default.
+    """
+    DEFAULT_FIELDS = {"id", "name", "price"}
+
+    category = serializers.SlugRelatedField(slug_field='slug', read_only=True)
+
     class Meta:
         model = Product
-        fields = ["id", "name", "price"]
+        fields = [
+            "id", "name", "slug", "category", "description", "price", "stock",
+            "image_url", "requires_prescription", "active", "created_at", "updated_at",
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        requested = set()
+        if request is not None and request.query_params.get('fields'):
+            requested = {name.strip() for name in request.query_params['fields'].split(',')}
+        keep = (requested & set(self.fields)) or self.DEFAULT_FIELDS
+        for name in set(self.fields) - keep:
+            self.fields.pop(name)
@@ -0,0 +1,37 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import cache as catalog_cache
+from .models import Category, Product
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    get_search_backend().index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_caches(sender, **kwargs):
+    catalog_cache.bump_version(catalog_cache.PRODUCTS)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_caches(sender, **kwargs):
+    catalog_cache.bump_version(catalog_cache.CATEGORIES)
+
+
+@receiver(user_logged_in)
+def claim_prescriptions(sender, request, user, **kwargs):
+    from .prescriptions import claim_session_prescriptions
+
+    if request is not None and hasattr(request, 'session'):
+        claim_session_prescriptions(request, user)
@@ -1,2 +1,434 @@
-from django.test import TestCase
+from unittest import mock
 
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from .catalog import get_categories, get_featured_products
+from .matching import MedicineNameIndex, match_medicines, trigrams
+from .models import Category, Prescription, Product
+from .pagination import KeysetPaginator, encode_cursor
+from .search import BaseSearchBackend, IContainsSearchBackend, SqliteSearchBackend, get_search_backend
+
+
+@override_settings(GROQ_API_KEY='test-key')
+class PrescriptionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Fever', slug='fever')
+        self.dolo = Product.objects.create(
+            category=category, name='Dolo 650 Tablet', slug='dolo-650', description='', price=30, stock=5,
+        )
+
+    def upload(self, content=b'prescription photo'):
+        photo = SimpleUploadedFile('rx.jpg', content, content_type='image/jpeg')
+        return self.client.post('/upload-rx/', {'rx_image': photo})
+
+    @mock.patch('products.prescriptions.detect_medicines', return_value=['Dolo 650'])
+    def test_upload_is_stored_and_reused(self, detect_medicines):
+        response = self.upload()
+        self.assertEqual(list(response.context['matched_products']), [self.dolo])
+
+        prescription = Prescription.objects.get()
+        self.assertEqual(prescription.medicines, ['Dolo 650'])
+        self.assertEqual(prescription.matched_product_ids, [self.dolo.pk])
+        self.assertEqual(len(prescription.image_hash), 64)
+
+        self.upload()  # same photo again
+        detect_medicines.assert_called_once()
+        self.assertEqual(Prescription.objects.count(), 1)
+
+    @mock.patch('products.prescriptions.detect_medicines', return_value=['Dolo 650'])
+    def test_reopen_rematches_against_current_catalog(self, detect_medicines):
+        self.upload()
+        prescription = Prescription.objects.get()
+        self.dolo.name = 'Dolo 650mg Strip'
+        self.dolo.save()
+        syrup = Product.objects.create(
+            category=self.dolo.category, name='Dolo 650 Syrup', slug='dolo-syrup', description='', price=45, stock=5,
+        )
+
+        response = self.client.get(f'/prescriptions/{prescription.pk}/')
+
+        detect_medicines.assert_called_once()
+        self.assertIn(syrup, response.context['matched_products'])
+        prescription.refresh_from_db()
+        self.assertIn(syrup.pk, prescription.matched_product_ids)
+
+    @mock.patch('products.prescriptions.detect_medicines', return_value=['Dolo 650'])
+    def test_reopening_unchanged_matches_does_not_write(self, detect_medicines):
+        self.upload()
+        prescription = Prescription.objects.get()
+
+        with mock.patch.object(Prescription, 'save') as save:
+            response = self.client.get(f'/prescriptions/{prescription.pk}/')
+        self.assertEqual(list(response.context['matched_products']), [self.dolo])
+        save.assert_not_called()
+
+    @mock.patch('products.prescriptions.detect_medicines', return_value=['Dolo 650'])
+    def test_anonymous_prescriptions_follow_the_user_on_login(self, detect_medicines):
+        self.upload()
+        prescription = Prescription.objects.get()
+        user = User.objects.create_user('asha', password='pass12345')
+
+        self.client.post('/accounts/login/', {'username': 'asha', 'password': 'pass12345'})
+
+        prescription.refresh_from_db()
+        self.assertEqual((prescription.user, prescription.session_key), (user, None))
+        self.assertEqual(self.client.get(f'/prescriptions/{prescription.pk}/').status_code, 200)
+
+    @mock.patch('products.prescriptions.detect_medicines', return_value=['Dolo 650'])
+    def test_prescriptions_are_private(self, detect_medicines):
+        self.upload()
+        prescription = Prescription.objects.get()
+        self.client.cookies.clear()
+
+        self.assertEqual(self.client.get(f'/prescriptions/{prescription.pk}/').status_code, 404)
+        # The stored medicine list still saves the vision call for the same photo
+        self.upload()
+        detect_medicines.assert_called_once()
+        self.assertEqual(Prescription.objects.count(), 2)
+
+
+def indexed_rowids():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT rowid FROM products_product_fts ORDER BY rowid")
+        return [row[0] for row in cursor.fetchall()]
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Fever', slug='fever')
+        self.dolo = Product.objects.create(
+            category=self.category, name='Dolo 650 Tablet', slug='dolo-650',
+            description='Paracetamol for fever and body ache', price=30, stock=5,
+        )
+        self.crocin = Product.objects.create(
+            category=self.category, name='Crocin Advance', slug='crocin',
+            description='Fast relief from headache, contains paracetamol', price=25, stock=5,
+        )
+
+    def search(self, query, queryset=None):
+        return list(get_search_backend().search(queryset or Product.objects.all(), query))
+
+    def test_sqlite_uses_fts5(self):
+        self.assertIsInstance(get_search_backend(), SqliteSearchBackend)
+        with self.assertRaises(TypeError):
+            BaseSearchBackend()  # ranked_hits is abstract
+
+    def test_saved_products_are_indexed_and_ranked(self):
+        self.assertEqual(indexed_rowids(), [self.dolo.pk, self.crocin.pk])
+        # Name matches (weighted 10x) outrank description matches
+        self.assertEqual(self.search('crocin paracetamol'), [self.crocin])
+        self.assertEqual(len(self.search('parac')), 2)  # prefix match
+        self.assertEqual({p.pk for p in self.search('paracetamol')}, {self.dolo.pk, self.crocin.pk})
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_search_respects_the_queryset(self):
+        self.crocin.active = False
+        self.crocin.save()
+        self.assertEqual(self.search('paracetamol', Product.objects.filter(active=True)), [self.dolo])
+
+    def test_updates_and_deletes_keep_the_index_current(self):
+        self.dolo.name = 'Calpol 500'
+        self.dolo.save()
+        self.assertEqual(self.search('dolo'), [])
+        self.assertEqual(self.search('calpol'), [self.dolo])
+
+        crocin_pk = self.crocin.pk
+        self.crocin.delete()
+        self.assertEqual(indexed_rowids(), [self.dolo.pk])
+        self.assertNotIn(crocin_pk, [p.pk for p in self.search('paracetamol')])
+
+    def test_rebuild_command_picks_up_bulk_writes(self):
+        Product.objects.filter(pk=self.dolo.pk).update(name='Calpol 500')  # no signals
+        self.assertEqual(self.search('calpol'), [])
+
+        call_command('rebuild_search_index', stdout=mock.Mock())
+
+        self.assertEqual(self.search('calpol'), [self.dolo])
+
+
+class SearchMigrationTests(TransactionTestCase):
+    before = [('products', '0002_product_image_url')]
+    after = [('products', '0003_product_search_index')]
+
+    def tearDown(self):
+        MigrationExecutor(connection).migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_existing_products_are_backfilled(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        old_apps = executor.loader.project_state(self.before).apps
+        category = old_apps.get_model('products', 'Category').objects.create(name='Fever', slug='fever')
+        product = old_apps.get_model('products', 'Product').objects.create(
+            category=category, name='Dolo 650 Tablet', slug='dolo-650', description='', price=30, stock=5,
+        )
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+
+        self.assertEqual(indexed_rowids(), [product.pk])
+
+
+class MatchingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Fever', slug='fever')
+        self.dolo = Product.objects.create(
+            category=self.category, name='Dolo 650 Tablet', slug='dolo-650', description='', price=30, stock=5,
+        )
+        self.dolo_syrup = Product.objects.create(
+            category=self.category, name='Dolo 250 Suspension Syrup', slug='dolo-250', description='', price=40, stock=5,
+        )
+        self.crocin = Product.objects.create(
+            category=self.category, name='Crocin Advance', slug='crocin', description='', price=25, stock=5,
+        )
+
+    def test_trigrams_are_padded_per_word(self):
+        self.assertEqual(trigrams('ab'), {'  a', ' ab', 'ab '})
+        self.assertEqual(trigrams(''), set())
+
+    def test_exact_names_score_one_and_rank_first(self):
+        matched = match_medicines(['Dolo 650'])
+        self.assertEqual(matched[0], self.dolo)
+        self.assertEqual(matched[0].match_score, 1.0)
+        self.assertEqual(matched[0].matched_medicine, 'Dolo 650')
+
+    def test_misspelt_names_still_match(self):
+        matched = match_medicines(['Crosin Advanse'])
+        self.assertEqual(matched, [self.crocin])
+        self.assertGreaterEqual(matched[0].match_score, 0.5)
+        self.assertLess(matched[0].match_score, 1.0)
+
+    def test_unrelated_and_inactive_products_are_left_out(self):
+        self.assertEqual(match_medicines(['Azithromycin']), [])
+        self.crocin.active = False
+        self.crocin.save()
+        self.assertEqual(match_medicines(['Crocin Advance']), [])
+
+    def test_index_rebuilds_when_the_catalog_changes(self):
+        index = MedicineNameIndex()
+        self.assertEqual(index.match(['Pan 40']), {})
+        pan = Product.objects.create(
+            category=self.category, name='Pan 40 Tablet', slug='pan-40', description='', price=99, stock=5,
+        )
+        self.assertIn(pan.pk, index.match(['Pan 40']))
+
+    def test_one_query_loads_the_matched_products(self):
+        match_medicines(['Dolo'])  # builds the index
+        with self.assertNumQueries(1):
+            matched = match_medicines(['Dolo', 'Crocin'])
+        self.assertEqual({p.pk for p in matched}, {self.dolo.pk, self.dolo_syrup.pk, self.crocin.pk})
+
+
+class FeaturedProductsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.fever = Category.objects.create(name='Fever', slug='fever')
+        self.vitamins = Category.objects.create(name='Vitamins', slug='vitamins')
+
+    def make_product(self, category, slug, **kwargs):
+        return Product.objects.create(
+            category=category, name=slug.title(), slug=slug, description='', price=10, stock=5, **kwargs,
+        )
+
+    def test_newest_of_each_category_comes_first(self):
+        dolo = self.make_product(self.fever, 'dolo')
+        crocin = self.make_product(self.fever, 'crocin')
+        zincovit = self.make_product(self.vitamins, 'zincovit')
+        self.make_product(self.fever, 'hidden', active=False)
+
+        self.assertEqual(get_featured_products(), [zincovit, crocin, dolo])
+
+    def test_cached_until_the_catalog_changes(self):
+        dolo = self.make_product(self.fever, 'dolo')
+        self.assertEqual(get_featured_products(), [dolo])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_featured_products(), [dolo])
+
+        crocin = self.make_product(self.fever, 'crocin')  # bumps the products version
+        self.assertEqual(get_featured_products(), [crocin, dolo])
+
+    def test_home_page_lists_featured_products(self):
+        self.make_product(self.fever, 'dolo')
+        response = self.client.get('/')
+        self.assertContains(response, 'Dolo')
+
+
+class CategoryRegistryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.vitamins = Category.objects.create(name='Vitamins', slug='vitamins')
+        self.fever = Category.objects.create(name='Fever', slug='fever')
+
+    def test_categories_are_cached_until_one_changes(self):
+        self.assertEqual(get_categories(), [self.fever, self.vitamins])
+        with self.assertNumQueries(0):
+            get_categories()
+
+        diabetes = Category.objects.create(name='Diabetes', slug='diabetes')
+        self.assertEqual(get_categories(), [diabetes, self.fever, self.vitamins])
+        self.fever.delete()
+        self.assertEqual(get_categories(), [diabetes, self.vitamins])
+
+    def test_nav_keeps_the_fixed_links_and_lists_categories(self):
+        response = self.client.get('/')
+        self.assertContains(response, '<a href="/">Lab Tests</a>', html=True)
+        self.assertContains(response, '/products/?category=fever')
+        self.assertContains(response, '/products/?category=vitamins')
+
+
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Fever', slug='fever')
+        self.products = [
+            Product.objects.create(
+                category=self.category, name=f'Paracetamol {i}', slug=f'para-{i}', description='', price=10, stock=5,
+            )
+            for i in range(7)
+        ]
+
+    def walk(self, object_list, per_page=3):
+        paginator = KeysetPaginator(object_list, per_page)
+        seen, cursor = [], None
+        while True:
+            page = paginator.get_page(cursor)
+            seen.append([p.pk for p in page])
+            if not page.has_next():
+                return seen
+            cursor = page.next_cursor
+
+    def test_pages_walk_newest_first_without_gaps(self):
+        pages = self.walk(Product.objects.all())
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), [p.pk for p in reversed(self.products)])
+
+    def test_ties_on_created_at_are_broken_by_id(self):
+        Product.objects.update(created_at=self.products[0].created_at)
+        pages = self.walk(Product.objects.all())
+        self.assertEqual(sum(pages, []), sorted((p.pk for p in self.products), reverse=True))
+
+    def test_search_results_page_by_rank(self):
+        results = get_search_backend().search(Product.objects.all(), 'paracetamol')
+        pages = self.walk(results)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), [pk for pk, _rank in results.hits])
+
+    def test_fallback_search_pages_do_not_repeat_or_skip(self):
+        # icontains ranks every hit 0.0 and orders them newest first
+        results = IContainsSearchBackend().search(Product.objects.all(), 'paracetamol')
+        pages = self.walk(results)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), [p.pk for p in reversed(self.products)])
+
+    def test_search_cursor_survives_hits_moving(self):
+        results = get_search_backend().search(Product.objects.all(), 'paracetamol')
+        first = KeysetPaginator(results, 3).get_page(None)
+        shown = [p.pk for p in first]
+        self.products[0].delete()  # a hit before the cursor disappears
+
+        results = get_search_backend().search(Product.objects.all(), 'paracetamol')
+        second = KeysetPaginator(results, 3).get_page(first.next_cursor)
+        remaining = [pk for pk, _rank in results.hits]
+        self.assertEqual([p.pk for p in second], remaining[remaining.index(shown[-1]) + 1:][:3])
+
+    def test_bad_cursors_fall_back_to_the_first_page(self):
+        first_page = [p.pk for p in KeysetPaginator(Product.objects.all(), 3).get_page(None)]
+        search_first_page = [pk for pk, _rank in get_search_backend().search(Product.objects.all(), 'paracetamol').hits[:3]]
+        bad_cursors = [
+            'not base64!', '%%%', encode_cursor('text'), encode_cursor([1, 2, 3]),
+            encode_cursor(['2024-13-45T99:00:00', 1]), encode_cursor(['yesterday', 1]),
+            encode_cursor(['2999-01-01T00:00:00+00:00', 10 ** 30]), encode_cursor([1.5, True]), encode_cursor([{}, None]), encode_cursor([-3, 1]), encode_cursor([999, 1]),
+            encode_cursor(['NaN', 'x']),
+        ]
+        for cursor in bad_cursors:
+            with self.subTest(cursor=cursor):
+                page = KeysetPaginator(Product.objects.all(), 3).get_page(cursor)
+                self.assertEqual([p.pk for p in page], first_page)
+                results = get_search_backend().search(Product.objects.all(), 'paracetamol')
+                page = KeysetPaginator(results, 3).get_page(cursor)
+                self.assertEqual([p.pk for p in page], search_first_page)
+
+    def test_product_list_never_errors_on_a_tampered_cursor(self):
+        for cursor in ('garbage', encode_cursor(['2024-02-30T00:00:00', 1]), encode_cursor([1e308, 10 ** 30])):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get('/products/', {'cursor': cursor}).status_code, 200)
+                self.assertEqual(self.client.get('/products/', {'q': 'paracetamol', 'cursor': cursor}).status_code, 200)
+
+
+class ProductsApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.fever = Category.objects.create(name='Fever', slug='fever')
+        self.antibiotics = Category.objects.create(name='Antibiotics', slug='antibiotics')
+        self.dolo = Product.objects.create(
+            category=self.fever, name='Dolo 650 Tablet', slug='dolo-650', description='', price=30, stock=5,
+        )
+        self.azee = Product.objects.create(
+            category=self.antibiotics, name='Azee 500', slug='azee-500', description='', price=120, stock=5,
+            requires_prescription=True,
+        )
+        self.old_stock = Product.objects.create(
+            category=self.fever, name='Old Stock', slug='old-stock', description='', price=5, stock=0, active=False,
+        )
+
+    def names(self, response):
+        return [product['name'] for product in response.json()['results']]
+
+    def test_default_fields_are_unchanged(self):
+        response = self.client.get('/api/products/')
+        self.assertEqual(response.json()['results'][0], {'id': self.old_stock.pk, 'name': 'Old Stock', 'price': '5.00'})
+
+    def test_extra_fields_are_opt_in(self):
+        response = self.client.get(f'/api/products/{self.azee.pk}/', {'fields': 'id,category,requires_prescription,bogus'})
+        self.assertEqual(response.json(), {'id': self.azee.pk, 'category': 'antibiotics', 'requires_prescription': True})
+        response = self.client.get(f'/api/products/{self.azee.pk}/', {'fields': 'bogus'})
+        self.assertEqual(set(response.json()), {'id', 'name', 'price'})
+
+    def test_filters(self):
+        self.assertEqual(self.names(self.client.get('/api/products/', {'category': 'fever'})), ['Old Stock', 'Dolo 650 Tablet'])
+        self.assertEqual(self.names(self.client.get('/api/products/', {'active': 'true'})), ['Azee 500', 'Dolo 650 Tablet'])
+        self.assertEqual(self.names(self.client.get('/api/products/', {'prescription': '1'})), ['Azee 500'])
+        self.assertEqual(self.names(self.client.get('/api/products/', {'category': 'fever', 'active': 'no'})), ['Old Stock'])
+
+    def test_cursor_pagination(self):
+        first = self.client.get('/api/products/', {'page_size': 2}).json()
+        self.assertEqual([p['name'] for p in first['results']], ['Old Stock', 'Azee 500'])
+        self.assertIsNone(first['previous'])
+
+        second = self.client.get(first['next']).json()
+        self.assertEqual([p['name'] for p in second['results']], ['Dolo 650 Tablet'])
+        self.assertIsNone(second['next'])
+
+    def test_unchanged_list_is_a_304_without_queries(self):
+        response = self.client.get('/api/products/')
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # Another query string is another representation
+        self.assertEqual(self.client.get('/api/products/?active=true', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_etag_changes_on_save_and_delete(self):
+        etag = self.client.get('/api/products/')['ETag']
+        self.dolo.price = 32
+        self.dolo.save()
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        self.old_stock.delete()
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail_304_and_last_modified(self):
+        response = self.client.get(f'/api/products/{self.dolo.pk}/')
+        self.assertIn('Last-Modified', response)
+        response = self.client.get(f'/api/products/{self.dolo.pk}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
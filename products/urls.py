@@ -13,5 +13,6 @@ urlpatterns = [
     path("products/", views.product_list, name="product_list"),
     path("product/<slug:slug>/", views.product_detail, name="product_detail"),
     path("upload-rx/", views.upload_rx, name="upload_rx"),
+    path("prescriptions/<int:pk>/", views.prescription_detail, name="prescription_detail"),
     path("api/", include(router.urls)),
 ]
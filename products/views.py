@@ -1,6 +1,9 @@
 from django.shortcuts import render, get_object_or_404
-from django.db.models import Q
-from .models import Product, Category
+from .models import Product
+from .search import get_search_backend
+from .prescriptions import owned_prescriptions, record_prescription, rematch
+from .catalog import get_featured_products
+from .pagination import KeysetPaginator
 import logging
 from django.conf import settings
 from django.core.files.storage import default_storage
@@ -9,32 +12,11 @@ from django.core.files.base import ContentFile
 
 
 def home(request):
-    # Fetch all active products sorted by newest first
-    all_products = Product.objects.filter(active=True).order_by('-created_at')
-    
-    featured_products = []
-    seen_categories = set()
-    
-    # First pass: try to get one from each category
-    for product in all_products:
-        if product.category_id not in seen_categories:
-            featured_products.append(product)
-            seen_categories.add(product.category_id)
-            if len(featured_products) == 6:
-                break
-    
-    # Second pass: fill up to 6 if needed
-    if len(featured_products) < 6:
-        for product in all_products:
-            if product not in featured_products:
-                featured_products.append(product)
-                if len(featured_products) == 6:
-                    break
-                    
-    categories = Category.objects.all()
+    # One product per category (newest first), precomputed and cached
+    featured_products = get_featured_products()
+
     return render(request, 'products/home.html', {
         'featured_products': featured_products,
-        'categories': categories
     })
 
 def product_list(request):
@@ -42,20 +24,16 @@ def product_list(request):
     query = request.GET.get('q')
     category_slug = request.GET.get('category')
     
-    if query:
-        products = products.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query)
-        )
-    
-    from django.core.paginator import Paginator
-
     if category_slug:
         products = products.filter(category__slug=category_slug)
+
+    if query:
+        # Ranked full-text hits; products for the page are loaded lazily
+        products = get_search_backend().search(products, query)
     
-    paginator = Paginator(products, 50)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination: no COUNT/OFFSET, deep pages cost the same as page 1
+    paginator = KeysetPaginator(products, 50)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     # Robust AJAX detection
     is_ajax = (
@@ -66,10 +44,8 @@ def product_list(request):
     if is_ajax:
         return render(request, 'products/partials/product_list_chunk.html', {'products': page_obj})
 
-    categories = Category.objects.all()
     return render(request, 'products/product_list.html', {
         'products': page_obj,
-        'categories': categories,
         'query': query
     })
 
@@ -80,17 +56,92 @@ def product_detail(request, slug):
 
 
 
+from hashlib import md5
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
+from . import cache as catalog_cache
 from .models import Product
+from .pagination import ProductCursorPagination
 from .serializers import ProductSerializer
 
 
+def _parse_bool(value):
+    if value is None:
+        return None
+    return value.lower() in ('1', 'true', 'yes')
+
+
 class ProductsApi(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+    """
+    Catalog API. List responses are cursor paginated and filterable with
+    ``category`` (slug), ``active`` and ``prescription``. GETs carry an ETag
+    so pollers get 304s: lists are keyed on the catalog version tokens, which
+    every product or category save/delete bumps, so no query runs for a 304;
+    single products also send Last-Modified from their updated_at.
+    """
+    queryset = Product.objects.select_related('category')
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+
+        if params.get('category'):
+            queryset = queryset.filter(category__slug=params['category'])
+        active = _parse_bool(params.get('active'))
+        if active is not None:
+            queryset = queryset.filter(active=active)
+        prescription = _parse_bool(params.get('prescription'))
+        if prescription is not None:
+            queryset = queryset.filter(requires_prescription=prescription)
+        return queryset
+
+    def _conditional(self, request, version, last_modified=None):
+        """Return (304 response or None, validator headers) for this GET."""
+        # Different query strings and renderers are different representations
+        fingerprint = f'{version}:{request.get_full_path()}:{request.accepted_renderer.format}'
+        etag = quote_etag(md5(fingerprint.encode()).hexdigest())
+        headers = {'ETag': etag}
+        timestamp = None
+        if last_modified is not None:
+            timestamp = int(last_modified.timestamp())
+            headers['Last-Modified'] = http_date(timestamp)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if not_modified is not None:
+            for name, value in headers.items():
+                not_modified[name] = value
+        return not_modified, headers
+
+    def list(self, request, *args, **kwargs):
+        version = '{}:{}'.format(
+            catalog_cache.get_version(catalog_cache.PRODUCTS),
+            catalog_cache.get_version(catalog_cache.CATEGORIES),
+        )
+        not_modified, headers = self._conditional(request, version)
+        if not_modified is not None:
+            return not_modified
+        response = super().list(request, *args, **kwargs)
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        not_modified, headers = self._conditional(
+            request, f'{instance.pk}:{instance.updated_at.isoformat()}', instance.updated_at,
+        )
+        if not_modified is not None:
+            return not_modified
+        response = Response(self.get_serializer(instance).data)
+        for name, value in headers.items():
+            response[name] = value
+        return response
 
     @action(detail=True, methods=["get"])
     def schedule(self, request, pk=None):
@@ -101,134 +152,41 @@ class ProductsApi(viewsets.ModelViewSet):
             "price": product.price,
         })
 
+def render_prescription(request, prescription, matched_products):
+    # If no medicines detected or no matches found, return false
+    return render(request, 'products/rx_results.html', {
+        'prescription': prescription,
+        'detected_medicines': prescription.medicines or False,
+        'matched_products': matched_products if prescription.medicines and matched_products else False,
+    })
+
 def upload_rx(request):
-    import groq
-    import json
-    import os
-    import base64
-    
     if request.method == 'POST' and request.FILES.get('rx_image'):
         try:
             image_file = request.FILES['rx_image']
             
-            # Read image file and encode to base64
-            image_data = image_file.read()
-            base64_image = base64.b64encode(image_data).decode('utf-8')
-            
             api_key = settings.GROQ_API_KEY
             if not api_key:
                 return render(request, 'products/upload_rx.html', {'error': 'System Error: Groq API Key missing. Please set GROQ_API_KEY in .env'})
             
-            client = groq.Groq(api_key=api_key)
-            
-            # Improved Prompt for Vision Model
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text", 
-                            "text": """Analyze this prescription image and extract ONLY actual pharmaceutical medicine/drug names.
-                            
-IMPORTANT RULES:
-- Return ONLY a valid JSON list of strings (e.g. ["Medicine A", "Medicine B"])
-- ONLY include actual medicine names (like "Paracetamol", "Amoxicillin", "Metformin")
-- IGNORE any non-medicine text like:
-  * Instructions (e.g., "Take twice daily", "After meals")
-  * Patient information (e.g., "John Doe", "Age 45")
-  * Doctor information (e.g., "Dr. Smith", "License #123")
-  * Dates, addresses, or clinic names
-  * Non-medical terms like "Backtesting", "Paper Trading", etc.
-- If no actual medicine names are found, return an empty list []
-
-Do not include any other text or markdown formatting."""
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                            },
-                        },
-                    ],
-                }
-            ]
-
-            try:
-                # Use Llama 4 Scout which is multimodal
-                chat_completion = client.chat.completions.create(
-                    messages=messages,
-                    model="meta-llama/llama-4-scout-17b-16e-instruct",
-                    temperature=0.1
-                )
-                response_content = chat_completion.choices[0].message.content.strip()
-            except groq.BadRequestError as e:
-                # Fallback to Maverick if Scout fails
-                logging.warning(f"Llama 4 Scout failed, trying Maverick: {e}")
-                chat_completion = client.chat.completions.create(
-                    messages=messages,
-                    model="meta-llama/llama-4-maverick-17b-128e-instruct",
-                )
-                response_content = chat_completion.choices[0].message.content.strip()
+            # Vision model read (pre-processed image, cached by content hash),
+            # stored so the prescription can be re-opened later
+            prescription = record_prescription(request, image_file.read())
             
-            # Clean up potential markdown code blocks
-            if response_content.startswith('```json'):
-                response_content = response_content.replace('```json', '').replace('```', '')
-            elif response_content.startswith('```'):
-                response_content = response_content.replace('```', '')
-
-            try:
-                detected_medicines = json.loads(response_content)
-                if not isinstance(detected_medicines, list):
-                     if isinstance(detected_medicines, dict):
-                        for key, value in detected_medicines.items():
-                            if isinstance(value, list):
-                                detected_medicines = value
-                                break
-                     else:
-                        detected_medicines = []
-            except json.JSONDecodeError:
-                detected_medicines = []
-                logging.error(f"Failed to parse Groq response: {response_content}")
-            
-            # Additional filtering: Only keep items that might be medicine names
-            # This helps filter out obvious non-medicine terms
-            filtered_medicines = []
-            common_non_medical = ['backtesting', 'paper trading', 'trading alerts', 'algorithmic trading', 
-                                 'buy', 'sell', 'signal', 'indicator', 'strategy', 'test', 'demo']
-            
-            for med in detected_medicines:
-                med_lower = med.lower()
-                # Skip if it contains common non-medical terms
-                if any(term in med_lower for term in common_non_medical):
-                    continue
-                # Skip very short terms (likely not medicine names)
-                if len(med) < 3:
-                    continue
-                filtered_medicines.append(med)
-            
-            # Product Matching - only with filtered medicines
-            matched_products = []
-            for med in filtered_medicines:
-                # Search by name (icontains)
-                matches = Product.objects.filter(name__icontains=med, active=True)
-                for match in matches:
-                    if match not in matched_products:
-                        matched_products.append(match)
-            
-            # If no medicines detected or no matches found, return false
-            if not filtered_medicines or not matched_products:
-                return render(request, 'products/rx_results.html', {
-                    'detected_medicines': filtered_medicines if filtered_medicines else False,
-                    'matched_products': False
-                })
-            
-            return render(request, 'products/rx_results.html', {
-                'detected_medicines': filtered_medicines,
-                'matched_products': matched_products
-            })
+            # Product Matching - fuzzy trigram lookup for all medicines at once,
+            # best confidence first
+            matched_products = rematch(prescription)
+            return render_prescription(request, prescription, matched_products)
 
         except Exception as e:
             logging.error(f"Error processing Rx: {str(e)}")
             return render(request, 'products/upload_rx.html', {'error': f"Error processing image: {str(e)}"})
 
-    return render(request, 'products/upload_rx.html')
\ No newline at end of file
+    return render(request, 'products/upload_rx.html', {
+        'prescriptions': owned_prescriptions(request)[:10],
+    })
+
+def prescription_detail(request, pk):
+    """Re-opens a past prescription, matched against today's catalog."""
+    prescription = get_object_or_404(owned_prescriptions(request), pk=pk)
+    return render_prescription(request, prescription, rematch(prescription))